@@ -0,0 +1,190 @@
+"""
+Measure how booting scales with the number of nodes
+
+Each cluster size is booted in a fresh interpreter against an
+in-process fake cloud (`vcl.fakecloud.FakeCloud`), reporting the wall
+clock time, the API requests made and the peak memory of the process.
+Boots that fail, eg because of injected errors the client does not
+retry, are reported along with the error.
+
+  python benchmarks/boot_throughput.py [--sizes 10,100,1000] [--parallel N]
+                                       [--latency SEC] [--active-time MIN,MAX]
+                                       [--error-rate P] [--error-status CODE]
+                                       [--multi-create]
+"""
+
+from __future__ import print_function
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, SUPPRESS
+import json
+import os
+import subprocess
+import sys
+
+
+SPEC = """
+from vcl.specification import hostrange
+
+defaults = {{
+    'netmask': '255.255.0.0',
+    'subnet': '10.0.0.0/16',
+    'public_key': {public_key!r},
+    'private_key': '~/.ssh/id_rsa',
+    'domain_name': 'local',
+    'extra_disks': {{}},
+    'openstack': {{
+        'flavor': 'm1.large',
+        'image': 'Ubuntu-14.04-64',
+        'key_name': 'benchmark',
+        'network': 'net',
+        'create_floating_ip': False,
+        'floating_ip_pool': 'ext-net',
+        'security_groups': ['default', 'benchmark'],
+    }},
+    'provider': 'openstack',
+}}
+
+nodes = hostrange('node[0-{last}]',
+                  openstack={{'create_floating_ip': lambda i: i % {floating_every} == 0}})
+
+spec = dict(defaults=defaults, machines=[nodes], inventory=[])
+"""
+
+
+def getopts(argv=None):
+    p = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    p.add_argument('--sizes', default='10,100,1000',
+                   help='Comma separated numbers of nodes to boot')
+    p.add_argument('--parallel', '-j', type=int, default=32,
+                   help='Number of nodes to boot concurrently')
+    p.add_argument('--multi-create', '-M', default=False, action='store_true',
+                   help='Create identical nodes with one request per group')
+    p.add_argument('--latency', type=float, default=0.01,
+                   help='Seconds each API request takes')
+    p.add_argument('--active-time', default='1,3',
+                   help='Range of seconds servers take to become ACTIVE')
+    p.add_argument('--error-rate', type=float, default=0,
+                   help='Fraction of API requests failing with --error-status')
+    p.add_argument('--error-status', type=int, default=503,
+                   help='HTTP status of the failing API requests')
+    p.add_argument('--floating-every', type=int, default=10,
+                   help='Give every N-th node a floating ip')
+    p.add_argument('--poll', type=float, default=0.5,
+                   help='Seconds between server status listings')
+    p.add_argument('--json', default=False, action='store_true',
+                   help='Print the results as JSON')
+    p.add_argument('--run', type=int, default=None, help=SUPPRESS)
+    return p.parse_args(argv)
+
+
+def run(size, opts):
+    """Boot `size` nodes in this process and print the measurements"""
+
+    import random
+    import resource
+    import shutil
+    import tempfile
+    import time
+
+    from vcl.fakecloud import FakeCloud
+
+    low, high = map(float, opts.active_time.split(','))
+    rng = random.Random(0)
+    cloud = FakeCloud(latency=opts.latency,
+                      active_time=lambda: rng.uniform(low, high),
+                      error_rate=opts.error_rate,
+                      error_status=opts.error_status, seed=0)
+    os.environ.update(cloud.environ())
+
+    from vcl import openstack
+    from vcl.specification import load_spec, mk_nodes
+
+    tmp = tempfile.mkdtemp()
+    try:
+        public_key = os.path.join(tmp, 'id_rsa.pub')
+        with open(public_key, 'w') as fd:
+            fd.write('ssh-rsa AAAA benchmark\n')
+        spec_path = os.path.join(tmp, 'cluster.py')
+        with open(spec_path, 'w') as fd:
+            fd.write(SPEC.format(public_key=public_key, last=size - 1,
+                                 floating_every=opts.floating_every))
+
+        nodes = mk_nodes(load_spec(spec_path, cache=False), compact=True)
+        nova = openstack.get_client(http_session=cloud.session())
+
+        booted = 0
+        error = None
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        start = time.time()
+        try:
+            for _ in openstack.boot(nodes, client=nova,
+                                    parallel=opts.parallel,
+                                    multi_create=opts.multi_create,
+                                    waitForActiveSleep=opts.poll,
+                                    waitForActiveTimeout=high * 10 + 60):
+                booted += 1
+        except Exception as e:
+            error = '{}: {}'.format(type(e).__name__, e)
+        finally:
+            elapsed = time.time() - start
+            sys.stdout.close()
+            sys.stdout = stdout
+    finally:
+        shutil.rmtree(tmp)
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024                     # bytes there, KiB elsewhere
+
+    print(json.dumps(dict(nodes=size, seconds=elapsed,
+                          failed=size - booted, error=error,
+                          requests=sum(cloud.calls.values()),
+                          calls=dict(cloud.calls),
+                          peak_rss_kb=peak)))
+
+
+def main():
+    opts = getopts()
+
+    if opts.run is not None:
+        run(opts.run, opts)
+        return
+
+    results = []
+    for size in map(int, opts.sizes.split(',')):
+        args = [sys.executable, __file__, '--run', str(size)] + sys.argv[1:]
+        try:
+            out = subprocess.check_output(args)
+        except subprocess.CalledProcessError as e:
+            print('Benchmarking {} nodes failed with status {}'.format(size, e.returncode),
+                  file=sys.stderr)
+            continue
+        results.append(json.loads(out.splitlines()[-1]))
+
+    if opts.json:
+        print(json.dumps(results, indent=1))
+        return
+
+    print('{:>6} {:>9} {:>9} {:>9} {:>9} {:>10}'.format(
+        'nodes', 'seconds', 'nodes/s', 'failed', 'requests', 'peak MiB'))
+    for r in results:
+        print('{nodes:>6} {seconds:>9.2f} {rate:>9.1f} {failed:>9} {requests:>9} {mib:>10.1f}'
+              .format(rate=(r['nodes'] - r['failed']) / r['seconds'],
+                      mib=r['peak_rss_kb'] / 1024., **r))
+
+    for r in results:
+        if r['error']:
+            print('{} nodes: {}'.format(r['nodes'], r['error']))
+
+    print()
+    print('API requests per node:')
+    routes = sorted(set(route for r in results for route in r['calls']))
+    print('  {:<32}'.format('') + ''.join('{:>9}'.format(r['nodes']) for r in results))
+    for route in routes:
+        print('  {:<32}'.format(route) +
+              ''.join('{:>9.2f}'.format(r['calls'].get(route, 0) / float(r['nodes']))
+                      for r in results))
+
+
+if __name__ == '__main__':
+    main()
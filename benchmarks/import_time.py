@@ -0,0 +1,98 @@
+"""
+Measure the startup time of the vcl command line
+
+Each subcommand is started in a fresh interpreter, up to the point
+where its arguments are parsed, and compared to the startup time of
+the bare interpreter.  The modules that should only be imported by
+other subcommands must not show up.
+
+  python benchmarks/import_time.py [--repeat N] [--budget MS]
+
+Exits non-zero if `vcl ssh` takes longer than the budget.
+"""
+
+from __future__ import print_function
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import json
+import subprocess
+import sys
+
+
+SNIPPET = """
+import json, sys, time
+t0 = time.time()
+import vcl.__main__
+argv = {argv!r}
+opts = vcl.__main__.build_parser(argv).parse_args(argv)
+t1 = time.time()
+heavy = [m for m in ('traits', 'novaclient', 'keystoneclient')
+         if m in sys.modules]
+print(json.dumps(dict(seconds=t1 - t0, heavy=heavy)))
+"""
+
+COMMANDS = [
+    ('ssh', ['ssh', 'somehost']),
+    ('list', ['list']),
+    ('boot', ['boot', '--dry-run']),
+]
+
+# modules a subcommand must not import
+FORBIDDEN = {
+    'ssh': ['traits', 'novaclient', 'keystoneclient'],
+    'list': ['traits', 'novaclient', 'keystoneclient'],
+    'boot': [],
+}
+
+
+def wall_time(args, repeat):
+    import time
+    best = None
+    for _ in xrange(repeat):
+        t0 = time.time()
+        out = subprocess.check_output(args)
+        elapsed = time.time() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+
+def getopts():
+    p = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    p.add_argument('--repeat', '-r', type=int, default=5,
+                   help='Keep the best of this many runs')
+    p.add_argument('--budget', '-b', type=float, default=100,
+                   help='Maximum milliseconds `vcl ssh` may add to interpreter startup')
+    return p.parse_args()
+
+
+def main():
+    opts = getopts()
+
+    baseline, _ = wall_time([sys.executable, '-c', 'pass'], opts.repeat)
+    print('{:<8} {:>8.1f} ms'.format('python', baseline * 1000))
+
+    failed = False
+    for name, argv in COMMANDS:
+        total, out = wall_time([sys.executable, '-c', SNIPPET.format(argv=argv)],
+                               opts.repeat)
+        result = json.loads(out.splitlines()[-1])
+        extra = (total - baseline) * 1000
+
+        print('{:<8} {:>8.1f} ms (+{:.1f} ms, vcl imports {:.1f} ms) heavy modules: {}'
+              .format(name, total * 1000, extra, result['seconds'] * 1000,
+                      ', '.join(result['heavy']) or 'none'))
+
+        bad = set(result['heavy']) & set(FORBIDDEN[name])
+        if bad:
+            print('  FAIL: {} imports {}'.format(name, ', '.join(sorted(bad))))
+            failed = True
+
+        if name == 'ssh' and extra > opts.budget:
+            print('  FAIL: over the {} ms budget'.format(opts.budget))
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,7 @@ setup(
     packages=find_packages(),
     entry_points={'console_scripts': [
         'vcl = vcl.__main__:main',
+        'vcl-inventory = vcl.scripts.inventory:script',
     ]},
     license='Apache 2.0',
 )
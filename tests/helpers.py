@@ -0,0 +1,126 @@
+"""
+Fixtures shared by the tests: a fake cloud and specifications to boot on it
+"""
+
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from vcl import openstack
+from vcl.fakecloud import FakeCloud
+from vcl.specification import load_spec, mk_nodes
+
+
+SPEC = """
+from vcl.specification import hostrange
+
+defaults = {{
+    'netmask': '255.255.0.0',
+    'subnet': '10.0.0.0/16',
+    'public_key': {public_key!r},
+    'private_key': '~/.ssh/id_rsa',
+    'domain_name': 'local',
+    'extra_disks': {{}},
+    'openstack': {{
+        'flavor': 'm1.large',
+        'image': 'Ubuntu-14.04-64',
+        'key_name': 'test',
+        'network': 'net',
+        'create_floating_ip': False,
+        'floating_ip_pool': 'ext-net',
+        'security_groups': ['default', 'test'],
+    }},
+    'provider': 'openstack',
+}}
+
+nodes = hostrange('node[0-{last}]',
+                  openstack={{'create_floating_ip': lambda i: i < {floating}}})
+
+spec = dict(defaults=defaults, machines=[nodes], inventory=[])
+"""
+
+
+@contextlib.contextmanager
+def quiet():
+    """Discard the progress output of the body of the with block"""
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+class CloudTestCase(unittest.TestCase):
+    """Runs each test against a fresh `FakeCloud` (`self.cloud`)
+
+    `self.nova` is a client for it, and `self.environ` is set up so
+    that the `get_client` calls of `vcl.openstack` authenticate with it
+    too.
+    """
+
+    cloud_options = dict()
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cloud = FakeCloud(**dict(dict(active_time=0, seed=0),
+                                      **self.cloud_options))
+        self._environ = dict(os.environ)
+        os.environ.update(self.cloud.environ())
+        self.nova = self.client()
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self._environ)
+        shutil.rmtree(self.tmp)
+
+    def client(self, **kws):
+        nova = openstack.get_client(http_session=self.cloud.session(), **kws)
+        # do not make the tests wait for the retries
+        nova.client.session.backoff = 0.001
+        return nova
+
+    def path(self, name):
+        return os.path.join(self.tmp, name)
+
+    def create(self, *names):
+        """str... -> [Server]
+
+        Create servers named `names` directly, eg to leave them behind
+        as an interrupted run would
+        """
+
+        catalog = openstack.Catalog(self.nova)
+        image = catalog.image('Ubuntu-14.04-64')
+        flavor = catalog.flavor('m1.large')
+        nics = [{'net-id': catalog.network('net').id}]
+        return [self.nova.servers.create(name, image, flavor, nics=nics)
+                for name in names]
+
+    def nodes(self, count, floating=0):
+        """int -> int -> [Node]
+
+        `count` nodes named node0, node1, ... of which the first
+        `floating` get a floating ip
+        """
+
+        public_key = self.path('id_rsa.pub')
+        with open(public_key, 'w') as fd:
+            fd.write('ssh-rsa AAAA test\n')
+
+        spec_path = self.path('cluster.py')
+        with open(spec_path, 'w') as fd:
+            fd.write(SPEC.format(public_key=public_key, last=count - 1,
+                                 floating=floating))
+
+        return mk_nodes(load_spec(spec_path, cache=False), compact=True)
+
+    def boot(self, nodes, **kws):
+        """[Node] -> ... -> [Node]"""
+        kws.setdefault('client', self.nova)
+        kws.setdefault('waitForActiveSleep', 0.01)
+        with quiet():
+            return list(openstack.boot(nodes, **kws))
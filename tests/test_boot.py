@@ -0,0 +1,168 @@
+import itertools
+import unittest
+
+import novaclient.exceptions
+
+from vcl import openstack
+from vcl.journal import Journal
+
+from helpers import CloudTestCase
+
+
+class DryRunTest(CloudTestCase):
+
+    def test_makes_no_api_call(self):
+        nodes = self.nodes(5, floating=2)
+
+        booted = self.boot(nodes, dry_run=True, client=None)
+        booted += self.boot(nodes, dry_run=True, parallel=4, multi_create=True)
+
+        self.assertEqual(len(booted), 10)
+        self.assertEqual(sum(self.cloud.calls.values()), 0)
+
+
+class StatusPollingTest(CloudTestCase):
+
+    def test_servers_are_only_polled_with_listings(self):
+        booted = self.boot(self.nodes(5), parallel=5)
+
+        self.assertEqual(len(booted), 5)
+        self.assertEqual(self.cloud.calls['GET /servers/{id}'], 0)
+        self.assertGreater(self.cloud.calls['GET /servers/detail'], 0)
+
+    def test_server_changed_before_it_is_tracked(self):
+        self.cloud.active_time = iter([2.2, 0.2]).next
+        slow, fast = self.create('slow', 'fast')
+
+        # the listings move past the update of the fast server
+        poller = openstack.StatusPoller(self.nova, sleep_time=0.05)
+        poller.track(slow)
+        poller.wait(slow.id, max_time=5)
+
+        poller.track(fast)
+        self.assertEqual(poller.wait(fast.id, max_time=1).status, 'ACTIVE')
+
+
+class LeftoverServersTest(CloudTestCase):
+
+    def test_building_servers_are_waited_for_and_broken_ones_skipped(self):
+        self.cloud.active_time = itertools.chain([0.5], itertools.repeat(0)).next
+        building, errored, unaddressed = self.create('node0', 'node1', 'node2')
+        self.cloud.servers[errored.id].status = 'ERROR'
+        self.cloud.servers[unaddressed.id].network = 'other'
+
+        booted = self.boot(self.nodes(4), parallel=2)
+
+        self.assertEqual(sorted(node.hostname for node in booted), ['node0', 'node3'])
+        node0, = [node for node in booted if node.hostname == 'node0']
+        self.assertEqual(node0.ip, self.cloud.servers[building.id].ip)
+        self.assertEqual(len(self.cloud.servers), 4)
+
+
+class ResumeTest(CloudTestCase):
+
+    def journal(self, booted=False):
+        """Journal the phases of node0 for a server that is gone"""
+        journal = Journal(self.path('journal'), resume=True)
+        journal.record('node0', 'created', id='deleted')
+        journal.record('node0', 'active')
+        journal.record('node0', 'secgroups', names=['default', 'test'])
+        journal.record('node0', 'floating_ip', ip='172.16.9.9', allocated=False)
+        if booted:
+            journal.record('node0', 'ip', ip='10.0.9.9', floating_ip='172.16.9.9')
+        return journal
+
+    def check(self, journal):
+        with journal:
+            node0, = self.boot(self.nodes(1, floating=1), journal=journal)
+
+        server, = self.cloud.servers.values()
+        self.assertEqual(journal.get('node0', 'created'), dict(id=server.id))
+        self.assertEqual(sorted(server.security_groups), ['default', 'test'])
+        self.assertEqual(server.floating_ips, [node0.floating_ip])
+        self.assertNotEqual(node0.floating_ip, '172.16.9.9')
+        self.assertEqual(node0.ip, server.ip)
+
+    def test_phases_of_a_deleted_server_are_redone(self):
+        self.check(self.journal())
+
+    def test_booted_node_whose_server_is_gone_is_booted_again(self):
+        self.check(self.journal(booted=True))
+
+
+class MultiCreateTest(CloudTestCase):
+
+    def refuse(self, *methods):
+        """Make the cloud answer `methods` requests on servers with a 400
+
+        Returns the original handler.
+        """
+
+        handler = self.cloud._nova_servers
+
+        def refusing(method, parts, query, body):
+            if method in methods:
+                return 400, {}, self.cloud._fault(400, 'Refused')
+            return handler(method, parts, query, body)
+
+        self.cloud._nova_servers = refusing
+        return handler
+
+    def test_creates_one_server_per_node(self):
+        booted = self.boot(self.nodes(4), multi_create=True)
+
+        self.assertEqual(self.cloud.calls['POST /servers'], 1)
+        self.assertEqual(sorted(server.name for server in self.cloud.servers.values()),
+                         sorted(node.hostname for node in booted))
+
+    def test_servers_becoming_active_one_after_the_other(self):
+        self.cloud.active_time = iter([0.2, 3, 1.2, 2.2, 0.2, 1.2]).next
+
+        booted = self.boot(self.nodes(6), multi_create=True, parallel=2,
+                           waitForActiveTimeout=5)
+
+        self.assertEqual(len(booted), 6)
+        self.assertEqual(self.cloud.calls['GET /servers/{id}'], 0)
+
+    def test_failed_rename_deletes_the_batch(self):
+        self.refuse('PUT')
+        journal = Journal(self.path('journal'))
+
+        with self.assertRaises(novaclient.exceptions.BadRequest):
+            self.boot(self.nodes(3), multi_create=True, journal=journal)
+
+        self.assertEqual(len(self.cloud.servers), 0)
+        for i in range(3):
+            self.assertFalse(journal.done('node{}'.format(i), 'created'))
+
+    def test_resume_renames_the_batch(self):
+        # nor can the servers that were not renamed be deleted
+        handler = self.refuse('PUT', 'DELETE')
+
+        with Journal(self.path('journal')) as journal:
+            with self.assertRaises(novaclient.exceptions.BadRequest):
+                self.boot(self.nodes(3), multi_create=True, journal=journal)
+        self.assertEqual(len(self.cloud.servers), 3)
+
+        self.cloud._nova_servers = handler
+        with Journal(self.path('journal'), resume=True) as journal:
+            booted = self.boot(self.nodes(3), multi_create=True, journal=journal)
+
+        self.assertEqual(self.cloud.calls['POST /servers'], 1)
+        self.assertEqual(sorted(server.name for server in self.cloud.servers.values()),
+                         sorted(node.hostname for node in booted))
+
+
+class InjectedErrorsTest(CloudTestCase):
+
+    cloud_options = dict(error_rate=0.2)
+
+    def test_boot_survives_transient_errors(self):
+        booted = self.boot(self.nodes(10, floating=3), multi_create=True)
+
+        self.assertEqual(len(booted), 10)
+        self.assertEqual(len(self.cloud.servers), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+
+from vcl import openstack
+from vcl.journal import Journal
+
+from helpers import CloudTestCase, quiet
+
+
+class DestroyTest(CloudTestCase):
+
+    def setUp(self):
+        super(DestroyTest, self).setUp()
+        self.names = ['node0', 'node1', 'node2']
+        with Journal(self.path('journal')) as journal:
+            self.boot(self.nodes(3, floating=2), journal=journal)
+        self.assertEqual(len(self.cloud.floating_ips), 2)
+
+    def destroy(self, journal, **kws):
+        with quiet():
+            return openstack.destroy(self.names, journal=journal,
+                                     client=self.nova,
+                                     waitForDeletedSleep=0.01, **kws)
+
+    def server(self, name):
+        server, = [server for server in self.cloud.servers.values()
+                   if server.name == name]
+        return server
+
+    def assertDeleted(self):
+        self.assertEqual(len(self.cloud.servers), 0)
+
+    def test_releases_the_floating_ips(self):
+        with Journal(self.path('journal'), resume=True) as journal:
+            deleted = self.destroy(journal)
+
+        self.assertEqual(sorted(deleted), self.names)
+        self.assertDeleted()
+        self.assertEqual(len(self.cloud.floating_ips), 0)
+        for name in self.names:
+            self.assertIsNone(journal.get(name, 'created'))
+
+    def test_releases_the_floating_ips_after_booting_again(self):
+        # a boot without --resume must not lose the journal
+        with Journal(self.path('journal')) as journal:
+            self.boot(self.nodes(3, floating=2), journal=journal)
+
+        with Journal(self.path('journal'), resume=True) as journal:
+            self.destroy(journal)
+
+        self.assertDeleted()
+        self.assertEqual(len(self.cloud.floating_ips), 0)
+
+    def test_releases_the_floating_ips_without_a_journal(self):
+        self.destroy(Journal())
+
+        self.assertDeleted()
+        self.assertEqual(len(self.cloud.floating_ips), 0)
+
+    def test_errored_servers_are_waited_for(self):
+        self.cloud.delete_time = 0.5
+        for server in self.cloud.servers.values():
+            server.status = 'ERROR'
+
+        with Journal(self.path('journal'), resume=True) as journal:
+            deleted = self.destroy(journal)
+
+        self.assertEqual(sorted(deleted), self.names)
+        self.assertDeleted()
+        self.assertEqual(len(self.cloud.floating_ips), 0)
+        self.assertIsNone(journal.get('node0', 'created'))
+
+    def test_failed_delete_is_reported(self):
+        self.cloud.delete_time = 60
+        handler = self.cloud._nova_servers
+
+        def failing(method, parts, query, body):
+            result = handler(method, parts, query, body)
+            if method == 'DELETE':
+                server = self.cloud.servers[parts[0]]
+                server.status, server.task_state = 'ERROR', None
+            return result
+
+        self.cloud._nova_servers = failing
+        with self.assertRaises(RuntimeError) as raised:
+            self.destroy(Journal())
+        self.assertIn('Failed to delete', str(raised.exception))
+
+    def test_stale_journal_addresses_of_other_servers_are_kept(self):
+        # node0's address moved on to a server booted by other means
+        other, = self.create('other')
+        journaled = [fip for fip in self.cloud.floating_ips.values()
+                     if fip['instance_id'] == self.server('node0').id][0]
+        journaled['instance_id'] = other.id
+        self.names = ['node0']
+
+        with Journal(self.path('journal'), resume=True) as journal:
+            self.destroy(journal)
+
+        self.assertEqual([fip['instance_id'] for fip in self.cloud.floating_ips.values()],
+                         [other.id, self.server('node1').id])
+
+    def test_keeps_the_floating_ips(self):
+        with Journal(self.path('journal'), resume=True) as journal:
+            self.destroy(journal, release_floating_ips=False)
+
+        self.assertDeleted()
+        self.assertEqual([fip['instance_id'] for fip in self.cloud.floating_ips.values()],
+                         [None, None])
+
+    def test_dry_run_deletes_nothing(self):
+        with Journal(self.path('journal'), resume=True) as journal:
+            deleted = self.destroy(journal, dry_run=True)
+
+        self.assertEqual(sorted(deleted), self.names)
+        self.assertEqual(len(self.cloud.servers), 3)
+        self.assertEqual(len(self.cloud.floating_ips), 2)
+        self.assertIsNotNone(journal.get('node0', 'created'))
+
+
+if __name__ == '__main__':
+    unittest.main()
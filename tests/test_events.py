@@ -0,0 +1,58 @@
+import unittest
+
+from vcl.events import EventLog, api_route, percentile
+
+from helpers import CloudTestCase
+
+
+class ApiRouteTest(unittest.TestCase):
+
+    def test_ids_are_replaced(self):
+        self.assertEqual(
+            api_route('GET', 'http://nova/v2/servers/6f1c09b2-9a4e-4bd1-8f4e-0d1d2a3b4c5d?x=1'),
+            'GET /v2/servers/{id}')
+        self.assertEqual(api_route('DELETE', 'http://nova/v2/os-floating-ips/42'),
+                         'DELETE /v2/os-floating-ips/{id}')
+        self.assertEqual(api_route('GET', 'http://nova/v2/servers/detail'),
+                         'GET /v2/servers/detail')
+
+    def test_project_is_stripped(self):
+        self.assertEqual(api_route('POST', 'http://nova/v2/myproject/servers', 'myproject'),
+                         'POST /v2/servers')
+        self.assertEqual(api_route('GET', 'http://nova/v2/myproject', 'myproject'),
+                         'GET /v2')
+
+
+class PercentileTest(unittest.TestCase):
+
+    def test_nearest_rank(self):
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([3], 90), 3)
+        self.assertIsNone(percentile([], 50))
+
+
+class BootEventsTest(CloudTestCase):
+
+    def test_phases_and_requests_are_recorded(self):
+        events = EventLog(self.path('events'))
+        nova = self.client(events=events)
+        self.boot(self.nodes(4, floating=1), client=nova, events=events)
+        events.close()
+
+        self.assertEqual(len(events.durations['create']), 4)
+        self.assertEqual(len(events.durations['floating_ip']), 1)
+        self.assertEqual(sum(events.requests.values()), sum(self.cloud.calls.values()))
+        self.assertEqual(events.requests['POST /v2/servers'], 4)
+        self.assertFalse([route for route in events.requests if 'fakeproject' in route])
+
+        with open(self.path('events')) as fd:
+            self.assertEqual(len(fd.readlines()),
+                             sum(map(len, events.durations.values()))
+                             + sum(events.requests.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
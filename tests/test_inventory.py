@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from vcl.scripts.inventory import host_vars
+from vcl.specification import load_spec, mk_nodes, update_spec, inventory_index
+
+
+SPEC = """
+from vcl.specification import hostrange, group
+
+defaults = {
+    'netmask': '255.255.0.0',
+    'public_key': '/keys/default.pub',
+    'private_key': '/keys/default',
+    'domain_name': 'local',
+    'extra_disks': {},
+    'openstack': {
+        'flavor': 'm1.large',
+        'image': 'Ubuntu-14.04-64',
+        'key_name': 'test',
+        'network': 'net',
+        'create_floating_ip': False,
+        'floating_ip_pool': 'ext-net',
+        'security_groups': ['default'],
+    },
+    'provider': 'openstack',
+}
+
+a = hostrange('a[0-3]', ip='10.0.0.{}', private_key='/keys/a')
+b = hostrange('b[0-2]', ip='10.0.1.{}')
+c = hostrange('c[0-0]', ip='10.0.2.{}', private_key='/keys/c')
+
+spec = dict(
+    defaults=defaults,
+    machines=[a, b, c],
+    inventory=[
+        group('as', [(a, xrange(4))]),
+        group('bs', [(b, xrange(3))]),
+        group('firsts', [(a, [0]), (b, [0]), (c, [0])]),
+    ],
+)
+"""
+
+
+class HostVarsTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'cluster.py')
+            with open(path, 'w') as fd:
+                fd.write(SPEC)
+            spec = load_spec(path, cache=False)
+        finally:
+            shutil.rmtree(tmp)
+
+        self.nodes = mk_nodes(spec, compact=True)
+        update_spec(spec, self.nodes)
+        self.index = inventory_index(spec)
+
+    def expected(self, node):
+        return dict(ansible_ssh_host=node.ip,
+                    ansible_ssh_private_key=node.private_key)
+
+    def test_variables_are_split_over_groups(self):
+        self.assertEqual(self.index['as']['vars'],
+                         dict(ansible_ssh_private_key='/keys/a'))
+        self.assertEqual(self.index['_meta']['hostvars']['a1'].keys(),
+                         ['ansible_ssh_host'])
+
+    def test_host_vars_merge_the_groups(self):
+        for node in self.nodes:
+            self.assertEqual(host_vars(self.index, node.hostname),
+                             self.expected(node))
+
+    def test_host_vars_of_an_index_without_hostgroups(self):
+        del self.index['_meta']['hostgroups']
+        for node in self.nodes:
+            self.assertEqual(host_vars(self.index, node.hostname),
+                             self.expected(node))
+
+
+if __name__ == '__main__':
+    unittest.main()
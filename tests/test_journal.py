@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from vcl.journal import Journal
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_resume_loads_the_phases(self):
+        with Journal(self.path) as journal:
+            journal.record('node0', 'created', id='a')
+            journal.record('node0', 'active')
+
+        with Journal(self.path, resume=True) as journal:
+            self.assertTrue(journal.done('node0', 'active'))
+            self.assertFalse(journal.done('node0', 'secgroups'))
+            self.assertEqual(journal.get('node0', 'created'), dict(id='a'))
+
+    def test_without_resume_the_phases_are_kept_but_not_used(self):
+        with Journal(self.path) as journal:
+            journal.record('node0', 'created', id='a')
+
+        with Journal(self.path) as journal:
+            self.assertFalse(journal.done('node0', 'created'))
+            journal.record('node1', 'created', id='b')
+
+        with Journal(self.path, resume=True) as journal:
+            self.assertTrue(journal.done('node0', 'created'))
+            self.assertTrue(journal.done('node1', 'created'))
+
+    def test_created_discards_the_phases_of_the_previous_server(self):
+        with Journal(self.path) as journal:
+            journal.record('node0', 'created', id='a')
+            journal.record('node0', 'active')
+            journal.record('node0', 'created', id='b')
+            self.assertFalse(journal.done('node0', 'active'))
+
+        with Journal(self.path, resume=True) as journal:
+            self.assertFalse(journal.done('node0', 'active'))
+            self.assertEqual(journal.get('node0', 'created'), dict(id='b'))
+
+    def test_torn_last_line_is_ignored(self):
+        with Journal(self.path) as journal:
+            journal.record('node0', 'created', id='a')
+        with open(self.path, 'a') as fd:
+            fd.write('{"node": "node0", "pha')
+
+        with Journal(self.path, resume=True) as journal:
+            journal.record('node0', 'active')
+
+        with Journal(self.path, resume=True) as journal:
+            self.assertTrue(journal.done('node0', 'active'))
+
+    def test_forget(self):
+        with Journal(self.path) as journal:
+            journal.record('node0', 'created', id='a')
+            journal.record('node1', 'created', id='b')
+
+        with Journal(self.path) as journal:
+            journal.forget(['node0'])
+            journal.record('node2', 'created', id='c')
+
+        with Journal(self.path, resume=True) as journal:
+            self.assertFalse(journal.done('node0', 'created'))
+            self.assertTrue(journal.done('node1', 'created'))
+            self.assertTrue(journal.done('node2', 'created'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from vcl.machines import MachinesIndex, MachinesWriter, index_path, load_machines
+
+
+class Node(object):
+
+    def __init__(self, hostname, ip):
+        self.hostname = hostname
+        self.ip = ip
+
+    def to_simple_types(self):
+        return dict(hostname=self.hostname, ip=self.ip)
+
+
+class MachinesIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, '.machines.yml')
+        with MachinesWriter(self.path) as writer:
+            for i in xrange(50):
+                writer.write(Node('node{}'.format(i), '10.0.0.{}'.format(i)))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_writer_produces_the_file_and_its_index(self):
+        self.assertEqual(len(load_machines(self.path)), 50)
+        self.assertTrue(os.path.exists(index_path(self.path)))
+        self.assertEqual(sorted(os.listdir(self.tmp)),
+                         ['.machines.yml', '.machines.yml.idx'])
+
+    def test_lookups(self):
+        with MachinesIndex(self.path) as machines:
+            self.assertEqual(machines['node0'].ip, '10.0.0.0')
+            self.assertEqual(machines['node49'].ip, '10.0.0.49')
+            self.assertEqual(machines.get(u'node17').ip, '10.0.0.17')
+            self.assertTrue('node5' in machines)
+            self.assertFalse('node50' in machines)
+            self.assertRaises(KeyError, lambda: machines['node'])
+            self.assertEqual(list(machines.hostnames()),
+                             sorted('node{}'.format(i) for i in xrange(50)))
+
+    def test_stale_index_is_rebuilt(self):
+        with open(self.path, 'a') as fd:
+            fd.write('extra0:\n  hostname: extra0\n  ip: 10.0.1.0\n')
+
+        with MachinesIndex(self.path) as machines:
+            self.assertEqual(machines['extra0'].ip, '10.0.1.0')
+            self.assertEqual(machines['node3'].ip, '10.0.0.3')
+
+        with open(index_path(self.path)) as fd:
+            self.assertTrue(any(line.startswith('extra0\t') for line in fd))
+
+    def test_missing_index_is_rebuilt(self):
+        os.unlink(index_path(self.path))
+        with MachinesIndex(self.path) as machines:
+            self.assertEqual(machines['node42'].ip, '10.0.0.42')
+        self.assertTrue(os.path.exists(index_path(self.path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
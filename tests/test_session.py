@@ -0,0 +1,119 @@
+import time
+import unittest
+
+import requests
+from requests.adapters import BaseAdapter
+from keystoneclient import exceptions
+
+from vcl.ratelimit import TokenBucket
+from vcl.session import RetryingSession
+
+from helpers import CloudTestCase
+
+
+class Scripted(BaseAdapter):
+    """Answers with `statuses` in turn, then with 200"""
+
+    def __init__(self, statuses):
+        super(Scripted, self).__init__()
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def send(self, request, **kwargs):
+        self.calls += 1
+        resp = requests.Response()
+        resp.status_code = self.statuses.pop(0) if self.statuses else 200
+        resp.headers['Content-Type'] = 'application/json'
+        resp._content = '{}'
+        resp.request = request
+        resp.url = request.url
+        return resp
+
+    def close(self):
+        pass
+
+
+class RetryingSessionTest(unittest.TestCase):
+
+    def request(self, method, statuses, retries=3):
+        """Make a `method` request answered with `statuses`
+
+        Returns the number of requests sent.
+        """
+
+        adapter = Scripted(statuses)
+        http = requests.Session()
+        http.mount('http://', adapter)
+        session = RetryingSession(session=http, retries=retries, backoff=0.001)
+        session.request('http://cloud.test/', method, authenticated=False)
+        return adapter.calls
+
+    def test_retries_get_on_server_errors(self):
+        self.assertEqual(self.request('GET', [500, 502, 504]), 4)
+
+    def test_retries_post_the_server_rejected(self):
+        self.assertEqual(self.request('POST', [503, 429, 413]), 4)
+
+    def test_does_not_retry_post_the_server_may_have_acted_on(self):
+        for status in (500, 502, 504):
+            with self.assertRaises(exceptions.HttpError):
+                self.request('POST', [status])
+
+    def test_gives_up_after_retries(self):
+        with self.assertRaises(exceptions.HttpError):
+            self.request('GET', [500] * 3, retries=2)
+
+    def test_does_not_retry_client_errors(self):
+        with self.assertRaises(exceptions.HttpError):
+            self.request('GET', [404, 200])
+
+
+class RepeatableActionsTest(CloudTestCase):
+
+    def fail_every_other(self, handler):
+        """Make every other call of the cloud's `handler` fail with a 500"""
+
+        original = getattr(self.cloud, handler)
+        calls = []
+
+        def failing(*args):
+            calls.append(args)
+            if len(calls) % 2:
+                return 500, {}, self.cloud._fault(500, 'Injected error')
+            return original(*args)
+
+        setattr(self.cloud, handler, failing)
+
+    def test_boot_repeats_actions_and_floating_ip_allocations(self):
+        self.fail_every_other('_server_action')
+        self.fail_every_other('_nova_os_floating_ips')
+
+        booted = self.boot(self.nodes(3, floating=2))
+
+        self.assertEqual(len(booted), 3)
+        servers = self.cloud.servers.values()
+        self.assertTrue(all(server.security_groups == ['default', 'test']
+                            for server in servers))
+        self.assertEqual(sorted(len(server.floating_ips) for server in servers),
+                         [0, 1, 1])
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_is_immediate(self):
+        bucket = TokenBucket(10, burst=5)
+        start = time.time()
+        for _ in range(5):
+            bucket.acquire()
+        self.assertLess(time.time() - start, 0.05)
+
+    def test_limits_the_rate(self):
+        bucket = TokenBucket(100, burst=1)
+        start = time.time()
+        for _ in range(21):
+            bucket.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.19)
+
+
+if __name__ == '__main__':
+    unittest.main()
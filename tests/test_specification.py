@@ -0,0 +1,299 @@
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+from vcl import specification
+from vcl.namespace import mk_namespace
+from vcl.specification import load_spec, hostrange, group, count_machines, iter_machines
+from vcl.specification import mk_nodes, records_to_nodes, IPv4Pool, assign_addresses
+from vcl.specification import Inventory, HostGroup, combine, intersect
+
+from helpers import quiet
+
+
+SPEC = """
+import os
+
+with open({marker!r}, 'a') as fd:
+    fd.write('x')
+
+spec = dict(
+    defaults=dict(provider='openstack', flavor=os.getenv('VCL_TEST_FLAVOR', 'm1.small')),
+    machines=[{{'node0': {{'ip': '10.0.0.10'}}}}],
+    inventory=[],
+)
+"""
+
+
+class SpecCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp, 'cache')
+        self.marker = os.path.join(self.tmp, 'evaluated')
+        self.path = os.path.join(self.tmp, 'cluster.py')
+        with open(self.path, 'w') as fd:
+            fd.write(SPEC.format(marker=self.marker))
+        os.environ.pop('VCL_TEST_FLAVOR', None)
+
+    def tearDown(self):
+        os.environ.pop('VCL_TEST_FLAVOR', None)
+        shutil.rmtree(self.tmp)
+
+    def load(self):
+        """Load the specification, returning how often it was evaluated"""
+        spec = load_spec(self.path, cache_dir=self.cache_dir)
+        self.assertEqual(spec.machines[0]['node0']['ip'], '10.0.0.10')
+        return len(open(self.marker).read())
+
+    def cache_file(self):
+        paths = glob.glob(os.path.join(self.cache_dir, '*.pickle'))
+        self.assertEqual(len(paths), 1)
+        return paths[0]
+
+    def test_evaluated_once(self):
+        self.assertEqual(self.load(), 1)
+        self.assertEqual(self.load(), 1)
+
+    def test_environment_change_invalidates(self):
+        self.load()
+        os.environ['VCL_TEST_FLAVOR'] = 'm1.large'
+        self.assertEqual(self.load(), 2)
+
+    def test_format_change_invalidates(self):
+        self.load()
+        format = specification.SPEC_CACHE_FORMAT
+        specification.SPEC_CACHE_FORMAT += 1
+        try:
+            self.assertEqual(self.load(), 2)
+        finally:
+            specification.SPEC_CACHE_FORMAT = format
+
+    def test_unloadable_entry_is_a_miss(self):
+        self.load()
+        with open(self.cache_file(), 'wb') as fd:
+            # a class that does not exist (any more)
+            fd.write('cvcl.specification\nNoSuchClass\n(tR.')
+        self.assertEqual(self.load(), 2)
+
+    def test_entry_accessible_by_others_is_ignored(self):
+        self.load()
+        self.assertEqual(os.stat(self.cache_file()).st_mode & 0777, 0600)
+        os.chmod(self.cache_file(), 0666)
+        with quiet():
+            self.assertEqual(self.load(), 2)
+
+
+class HostRangeTest(unittest.TestCase):
+
+    def test_fields_are_rendered_with_the_index(self):
+        hosts = hostrange('slave[0-9]', ip='10.0.0.{}', disk=lambda i: i * 10,
+                          openstack={'flavor': 'm1.large', 'tags': ['n{i}']})
+        self.assertEqual(hosts(3), {'slave3': {'ip': '10.0.0.3', 'disk': 30,
+                                               'openstack': {'flavor': 'm1.large',
+                                                             'tags': ['n3']}}})
+
+    def test_zero_padding(self):
+        hosts = hostrange('node[001-100].local')
+        self.assertEqual(len(hosts), 100)
+        self.assertEqual(hosts.hostname(7), 'node007.local')
+        self.assertEqual(list(hosts)[-1], {'node100.local': {}})
+
+    def test_invalid_patterns(self):
+        self.assertRaises(ValueError, hostrange, 'node')
+        self.assertRaises(ValueError, hostrange, 'node[5-1]')
+
+    def test_machines_are_expanded_lazily(self):
+        machines = [{'master0': {}}, hostrange('slave[0-999999]')]
+        self.assertEqual(count_machines(machines), 1000001)
+        names = [m.keys()[0] for m, _ in zip(iter_machines(machines), xrange(3))]
+        self.assertEqual(names, ['master0', 'slave0', 'slave1'])
+
+    def test_group_of_ranges_is_stored_as_indices(self):
+        hosts = hostrange('slave[0-999]')
+        members = group('slaves', [(hosts, xrange(10, 1000))])['slaves']
+        self.assertEqual(len(members), 990)
+        self.assertEqual(list(members)[:2], ['slave10', 'slave11'])
+
+
+def mk_spec(*machines):
+    """dict... -> Namespace
+
+    An openstack specification of `machines`
+    """
+    return mk_namespace(dict(
+        defaults=dict(
+            netmask='255.255.0.0',
+            subnet='10.0.0.0/16',
+            public_key='~/.ssh/id_rsa.pub',
+            private_key='~/.ssh/id_rsa',
+            domain_name='local',
+            extra_disks=dict(),
+            openstack=dict(
+                flavor='m1.small',
+                image='Ubuntu-14.04-64',
+                key_name='test',
+                network='net',
+                create_floating_ip=False,
+                floating_ip_pool='ext-net',
+                security_groups=['default'],
+            ),
+            provider='openstack',
+        ),
+        machines=list(machines),
+        inventory=[],
+    ))
+
+
+class NodeRecordTest(unittest.TestCase):
+
+    def test_records_match_the_traits_nodes(self):
+        spec = mk_spec({'master0': {'ip': '10.0.0.10', 'openstack': {'flavor': 'm1.large'}}},
+                       {'slave0': {'openstack': {'create_floating_ip': True,
+                                                 'security_groups': ['default', 'ssh']}}},
+                       {'slave1': {'extra_disks': {'vdb': 10}, 'role': 'worker'}})
+
+        nodes = [node.to_simple_types() for node in mk_nodes(spec)]
+        records = mk_nodes(spec, compact=True)
+
+        self.assertEqual([record.to_simple_types() for record in records], nodes)
+        self.assertEqual([node.to_simple_types()
+                          for node in records_to_nodes(spec, records)], nodes)
+
+    def test_invalid_values_are_reported_together(self):
+        spec = mk_spec({'node0': {'ip': 'not-an-ip'}},
+                       {'node1': {'openstack': {'create_floating_ip': 'yes'}}},
+                       {'node2': {'openstack': {'security_groups': 'default'}}})
+
+        with self.assertRaises(ValueError) as raised:
+            mk_nodes(spec, compact=True)
+
+        message = str(raised.exception)
+        self.assertIn("node0.ip = 'not-an-ip'", message)
+        self.assertIn("node1.create_floating_ip = 'yes'", message)
+        self.assertIn("node2.security_groups = 'default'", message)
+
+    def test_mutable_defaults_are_copied_per_record(self):
+        spec = mk_spec({'node0': {}}, {'node1': {}})
+        node0, node1 = mk_nodes(spec, compact=True)
+
+        node0.security_groups.append('ssh')
+        node0.extra_disks['vdb'] = 10
+
+        self.assertEqual(node0.security_groups, ['default', 'ssh'])
+        self.assertEqual(node1.security_groups, ['default'])
+        self.assertEqual(node1.extra_disks, {})
+        self.assertEqual(type(node1)._defaults['security_groups'], ['default'])
+
+
+class Host(object):
+
+    def __init__(self, hostname, ip=None):
+        self.hostname = hostname
+        self.ip = ip
+
+
+class IPv4PoolTest(unittest.TestCase):
+
+    def test_allocation_skips_claimed_addresses(self):
+        pool = IPv4Pool('10.0.2.0/24')
+        pool.claim('10.0.2.3', 'slave1')
+        pool.claim('10.0.2.4', 'slave2')
+        self.assertEqual([pool.allocate('a'), pool.allocate('b')],
+                         ['10.0.2.2', '10.0.2.5'])
+
+    def test_explicit_addresses_are_claimed_first(self):
+        hosts = [Host('node0'), Host('node1', '10.0.0.2'), Host('node2')]
+        assign_addresses(hosts, subnet='10.0.0.0/24')
+        self.assertEqual([host.ip for host in hosts],
+                         ['10.0.0.3', '10.0.0.2', '10.0.0.4'])
+
+    def test_network_gateway_and_broadcast_are_not_handed_out(self):
+        pool = IPv4Pool('10.0.2.0/29')
+        allocated = []
+        with self.assertRaises(ValueError) as raised:
+            while True:
+                allocated.append(pool.allocate('node'))
+
+        self.assertEqual(allocated, ['10.0.2.{}'.format(i) for i in xrange(2, 7)])
+        self.assertIn('Subnet exhausted', str(raised.exception))
+
+    def test_exhausted_subnet(self):
+        hosts = [Host('node{}'.format(i)) for i in xrange(3)]
+        with self.assertRaises(ValueError):
+            assign_addresses(hosts, subnet='10.0.2.0/30')
+
+    def test_every_collision_is_reported(self):
+        hosts = [Host('node0', '10.0.0.5'), Host('node1', '10.0.0.5'),
+                 Host('node2', '10.0.0.6'), Host('node3', '10.0.0.6'),
+                 Host('node4', '10.0.0.5'), Host('node5')]
+
+        with self.assertRaises(ValueError) as raised:
+            assign_addresses(hosts, subnet='10.0.0.0/24')
+
+        message = str(raised.exception)
+        self.assertIn('10.0.0.5 of node1 is already used by node0', message)
+        self.assertIn('10.0.0.6 of node3 is already used by node2', message)
+        self.assertIn('10.0.0.5 of node4 is already used by node0', message)
+        self.assertIsNone(hosts[-1].ip)
+
+
+class InventoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = Inventory()
+        self.index.add_group('masters', ['master0', 'master1'])
+        self.index.add_group('slaves', ['slave1', 'slave0', 'master1'])
+        self.index.add_group('edge', ['slave0'])
+
+    def test_union_and_intersection(self):
+        self.index.union('all', 'masters', 'slaves', 'edge')
+        self.index.intersection('both', 'masters', 'slaves')
+
+        self.assertEqual(list(self.index.members('all')),
+                         ['master0', 'master1', 'slave1', 'slave0'])
+        self.assertEqual(list(self.index.members('both')), ['master1'])
+
+    def test_groups_of(self):
+        self.assertEqual(self.index.groups_of('slave0'), ['slaves', 'edge'])
+        self.assertEqual(self.index.groups_of('master1'), ['masters', 'slaves'])
+        self.assertEqual(self.index.groups_of('nobody'), [])
+
+        self.index.add_group('edge', ['master0'])
+        self.assertEqual(self.index.groups_of('slave0'), ['slaves'])
+
+    def test_combine_lists_sorted_by_name(self):
+        masters = {'masters': ['master1', 'master0']}
+        slaves = {'slaves': ['slave0', 'master1']}
+
+        self.assertEqual(combine('all', masters, slaves),
+                         {'all': ['master0', 'master1', 'slave0']})
+        self.assertEqual(intersect('both', masters, slaves),
+                         {'both': ['master1']})
+
+    def test_combine_and_intersect_ranges(self):
+        slaves = hostrange('slave[0-99]')
+        first = group('first', [(slaves, xrange(0, 60))])
+        last = group('last', [(slaves, xrange(40, 100))])
+
+        union = combine('all', first, last)['all']
+        both = intersect('both', first, last)['both']
+
+        self.assertIsInstance(both, HostGroup)
+        self.assertEqual(len(union), 100)
+        self.assertEqual(list(both), ['slave{}'.format(i) for i in xrange(40, 60)])
+
+    def test_combine_ranges_and_lists(self):
+        slaves = hostrange('slave[0-9]')
+        ranged = group('ranged', [(slaves, [2, 1])])
+        listed = {'listed': ['slave1', 'edge0']}
+
+        self.assertEqual(combine('all', ranged, listed),
+                         {'all': ['edge0', 'slave1', 'slave2']})
+        self.assertEqual(intersect('both', ranged, listed), {'both': ['slave1']})
+
+
+if __name__ == '__main__':
+    unittest.main()
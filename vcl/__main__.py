@@ -1,25 +1,38 @@
-
 import sys
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 import collections
+import importlib
 
-import vcl.scripts.boot
-import vcl.scripts.list_machines
-import vcl.scripts.ssh
 
-def main():
+# subcommands are only imported when chosen (or to show the help), so
+# that eg `vcl ssh` does not pay for importing the cloud clients
+SUBCOMMANDS = collections.OrderedDict()
+SUBCOMMANDS['boot'] = 'vcl.scripts.boot'
+SUBCOMMANDS['destroy'] = 'vcl.scripts.destroy'
+SUBCOMMANDS['list'] = 'vcl.scripts.list_machines'
+SUBCOMMANDS['status'] = 'vcl.scripts.status'
+SUBCOMMANDS['ssh' ] = 'vcl.scripts.ssh'
+SUBCOMMANDS['exec'] = 'vcl.scripts.execute'
+SUBCOMMANDS['inventory'] = 'vcl.scripts.inventory'
 
-    subcmds = collections.OrderedDict()
-    subcmds['boot'] = vcl.scripts.boot
-    subcmds['list'] = vcl.scripts.list_machines
-    subcmds['ssh' ] = vcl.scripts.ssh
 
+def build_parser(argv):
 
     parser = ArgumentParser() #formatter_class=ArgumentDefaultsHelpFormatter)
 
     subparsers = parser.add_subparsers(title='subcommands')
 
-    for cmd, module in subcmds.iteritems():
+    # the top level parser has no options of its own, so the first
+    # positional argument names the subcommand
+    chosen = next((arg for arg in argv if not arg.startswith('-')), None)
+
+    for cmd, modname in SUBCOMMANDS.iteritems():
+
+        if chosen in SUBCOMMANDS and cmd != chosen:
+            subparsers.add_parser(cmd)
+            continue
+
+        module = importlib.import_module(modname)
         sub = subparsers.add_parser(
             cmd,
             description=module.__doc__,
@@ -29,8 +42,15 @@ def main():
         module.add_parser(sub)
         sub.set_defaults(func=module.main)
 
+    return parser
+
+
+def main(argv=None):
+
+    argv = sys.argv[1:] if argv is None else argv
 
-    opts = parser.parse_args()
+    parser = build_parser(argv)
+    opts = parser.parse_args(argv)
     opts.func(opts)
 
 
@@ -0,0 +1,163 @@
+"""
+Structured record of where the time of a boot goes
+"""
+
+import collections
+import contextlib
+import json
+import math
+import re
+import threading
+import time
+import urlparse
+
+
+def api_route(method, url, project_id=None):
+    """str -> str -> str or None -> str
+
+    The route of an API request, without the `project_id` that Nova
+    puts in its endpoint and with ids replaced by {id}, eg
+    'GET /v2/servers/{id}'
+    """
+
+    path = urlparse.urlparse(url).path
+    if project_id:
+        path = re.sub('/' + re.escape(project_id) + '(?=/|$)', '', path, count=1)
+    path = re.sub(r'/(?=[^/]*\d)[0-9a-fA-F-]{8,}(?=/|$)|/\d+(?=/|$)', '/{id}', path)
+    return '{} {}'.format(method, path)
+
+
+def percentile(values, p):
+    """[float] -> float -> float
+
+    The `p`th percentile of the sorted `values` (nearest rank)
+    """
+
+    if not values:
+        return None
+    rank = int(math.ceil(p / 100. * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+class EventLog(object):
+    """Timing of the boot phases of each node and of the API requests
+
+    Each event is a JSON object with the `event` type and its `time`.
+    Events are written to `path` one per line as they happen, if a
+    path is given; the phase durations and request counts are kept in
+    memory for `summary` in any case.
+
+    >>> events = EventLog('boot.events')
+    >>> with events.phase('node0', 'create'):
+    ...     nova.servers.create(...)
+    >>> print events.summary()
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = open(path, 'w') if path is not None else None
+        self.durations = collections.defaultdict(list)
+        self.failures = collections.Counter()
+        self.requests = collections.Counter()
+        self._auth = None
+
+    def emit(self, event, **fields):
+        """Record an event of type `event`"""
+        fields['event'] = event
+        fields.setdefault('time', time.time())
+        if self._fd is None:
+            return
+        line = json.dumps(fields) + '\n'
+        with self._lock:
+            if self._fd is not None:
+                self._fd.write(line)
+                self._fd.flush()
+
+    @contextlib.contextmanager
+    def phase(self, node, name, **fields):
+        """Time phase `name` of `node` over the body of the with block"""
+
+        start = time.time()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.record(node, name, time.time() - start, ok=ok, start=start,
+                        **fields)
+
+    def record(self, node, name, seconds, ok=True, **fields):
+        """Record that phase `name` of `node` took `seconds`"""
+
+        with self._lock:
+            self.durations[name].append(seconds)
+            if not ok:
+                self.failures[name] += 1
+        self.emit('phase', node=node, phase=name, seconds=seconds, ok=ok,
+                  **fields)
+
+    def watch(self, session):
+        """Record the API requests made through keystoneclient `session`"""
+        self._auth = session.auth
+        session.session.hooks['response'].append(self.response_hook)
+
+    def _project_id(self):
+        # only known once authenticated, which takes no request then
+        auth_ref = getattr(self._auth, 'auth_ref', None)
+        return auth_ref.project_id if auth_ref is not None else None
+
+    def response_hook(self, resp, *args, **kwargs):
+        """A requests response hook recording each API request"""
+
+        route = api_route(resp.request.method, resp.request.url,
+                          self._project_id())
+        with self._lock:
+            self.requests[route] += 1
+        self.emit('request', route=route, status=resp.status_code,
+                  seconds=resp.elapsed.total_seconds())
+        return resp
+
+    def summary(self):
+        """str
+
+        The percentiles of the duration of each phase and the number of
+        API requests per route
+        """
+
+        lines = ['{:<12} {:>6} {:>8} {:>8} {:>8} {:>8} {:>9}'.format(
+            'phase', 'count', 'p50', 'p90', 'p99', 'max', 'failed')]
+
+        with self._lock:
+            durations = dict((k, sorted(v)) for k, v in self.durations.iteritems())
+            failures = dict(self.failures)
+            requests = dict(self.requests)
+
+        for name, values in sorted(durations.iteritems(),
+                                   key=lambda (name, values): -sum(values)):
+            lines.append('{:<12} {:>6} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f} {:>9}'.format(
+                name, len(values),
+                percentile(values, 50), percentile(values, 90),
+                percentile(values, 99), values[-1],
+                failures.get(name, 0)))
+
+        if requests:
+            lines.append('')
+            lines.append('{:<40} {:>8}'.format('API requests', sum(requests.values())))
+            for route, count in sorted(requests.iteritems(),
+                                       key=lambda (route, count): -count):
+                lines.append('  {:<38} {:>8}'.format(route, count))
+
+        return '\n'.join(lines)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                self._fd.close()
+                self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,420 @@
+"""
+In-process stand-in for the Keystone and Nova APIs used by vcl
+
+`FakeCloud` is a `requests` transport adapter answering the Keystone v3
+and Nova v2 requests that `vcl.openstack` makes, from in-memory state.
+Plugged into `get_client` it lets `boot` run against a simulated cloud
+with configurable API latency, time for servers to become ACTIVE,
+error injection and quotas:
+
+>>> cloud = FakeCloud(latency=0.02, active_time=lambda: random.uniform(5, 20))
+>>> cloud.environ()                # the OS_* variables pointing at it
+>>> nova = get_client(http_session=cloud.session())
+>>> list(boot(nodes, client=nova, parallel=16))
+>>> cloud.calls                    # requests made, per method and route
+"""
+
+import collections
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import urlparse
+import uuid
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+KEYSTONE_URL = 'http://keystone.fake/v3'
+NOVA_URL = 'http://nova.fake/v2'
+
+PROJECT_ID = 'fakeproject'
+
+
+def timestamp(t):
+    """float -> str
+
+    Nova's format for `updated`, with a resolution of one second
+    """
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(t))
+
+
+def _as_callable(value):
+    return value if callable(value) else (lambda: value)
+
+
+class _Server(object):
+
+    def __init__(self, ident, name, image, flavor, key_name, network, ip,
+                 ready_at, fails):
+        self.id = ident
+        self.name = name
+        self.image = image
+        self.flavor = flavor
+        self.key_name = key_name
+        self.network = network
+        self.ip = ip
+        self.created = time.time()
+        self.updated = self.created
+        self.ready_at = ready_at
+        self.fails = fails
+        self.status = 'BUILD'
+        self.task_state = None
+        self.deleted_at = None
+        self.security_groups = ['default']
+        self.floating_ips = []
+
+    def refresh(self, now):
+        if self.status == 'BUILD' and now >= self.ready_at:
+            self.status = 'ERROR' if self.fails else 'ACTIVE'
+            self.updated = self.ready_at
+
+    def touch(self):
+        self.updated = time.time()
+
+    def to_json(self):
+        addresses = [{'addr': self.ip, 'version': 4, 'OS-EXT-IPS:type': 'fixed'}]
+        addresses += [{'addr': ip, 'version': 4, 'OS-EXT-IPS:type': 'floating'}
+                      for ip in self.floating_ips]
+        return {
+            'id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'OS-EXT-STS:task_state': self.task_state,
+            'created': timestamp(self.created),
+            'updated': timestamp(self.updated),
+            'image': {'id': self.image},
+            'flavor': {'id': self.flavor},
+            'key_name': self.key_name,
+            # like nova, no addresses until the server is built
+            'addresses': {self.network: addresses} if self.status != 'BUILD' else {},
+            'security_groups': [{'name': name} for name in self.security_groups],
+            'metadata': {},
+            'links': [],
+        }
+
+
+class FakeCloud(BaseAdapter):
+    """A simulated OpenStack cloud, as a requests transport adapter
+
+    `latency` is the delay of every request, in seconds, or a function
+    returning it.  `active_time` is the time a server takes from being
+    created to becoming ACTIVE, or a function drawing it.  A fraction
+    `error_rate` of the Nova requests fails with `error_status` without
+    being acted on, and a fraction `build_failure_rate` of the servers
+    goes to ERROR instead of ACTIVE.  Deleted servers are listed, with
+    the 'deleting' task state and their previous status, for
+    `delete_time` seconds.  `quotas` limits the number of 'instances'
+    and 'floating_ips' (403 when exceeded).
+
+    The default `error_status`, 503, is one that the client retries for
+    any request.  A 500 is only retried for the requests that are safe
+    to repeat (see `vcl.session`), so with a 500 some boots fail.
+
+    `calls` counts the requests by method and route, eg
+    'GET /servers/detail' or 'POST /servers/{id}/action'.
+    """
+
+    def __init__(self, latency=0, active_time=1, error_rate=0, error_status=503,
+                 build_failure_rate=0, delete_time=0, quotas=None,
+                 images=('Ubuntu-14.04-64',),
+                 flavors=('m1.small', 'm1.medium', 'm1.large'),
+                 networks=('net',),
+                 floating_ip_pools=('ext-net',),
+                 seed=None):
+        super(FakeCloud, self).__init__()
+
+        self.latency = _as_callable(latency)
+        self.active_time = _as_callable(active_time)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.build_failure_rate = build_failure_rate
+        self.delete_time = delete_time
+        self.quotas = dict(quotas or dict())
+        self.random = random.Random(seed)
+
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._addresses = itertools.count(10)
+
+        self.images = dict((self._uuid(), name) for name in images)
+        self.flavors = dict((str(i), name) for i, name in enumerate(flavors, 1))
+        self.networks = dict((self._uuid(), label) for label in networks)
+        self.floating_ip_pools = list(floating_ip_pools)
+        self.keypairs = dict()
+        self.servers = collections.OrderedDict()
+        self.floating_ips = collections.OrderedDict()
+
+    def _uuid(self):
+        return str(uuid.UUID(int=self.random.getrandbits(128)))
+
+    ############################################################ plumbing
+
+    def environ(self):
+        """The OS_* environment variables for `get_client`"""
+        return dict(OS_AUTH_URL=KEYSTONE_URL,
+                    OS_USERNAME='fakeuser',
+                    OS_PASSWORD='fakepassword',
+                    OS_PROJECT_NAME='fakeproject')
+
+    def session(self):
+        """A requests session sending everything to this cloud"""
+        session = requests.Session()
+        session.mount('http://', self)
+        session.mount('https://', self)
+        return session
+
+    def close(self):
+        pass
+
+    def send(self, request, **kwargs):
+
+        time.sleep(max(0, self.latency()))
+
+        url = urlparse.urlparse(request.url)
+        query = dict((k, v[-1])
+                     for k, v in urlparse.parse_qs(url.query).iteritems())
+        body = json.loads(request.body) if request.body else None
+
+        with self._lock:
+            if url.netloc == 'keystone.fake':
+                route, status, headers, payload = \
+                    self._keystone(request.method, url.path, body)
+            else:
+                path = url.path[len(urlparse.urlparse(NOVA_URL).path):]
+                path = path[len('/' + PROJECT_ID):]
+                route = re.sub(r'/[0-9a-f-]{8,}|/\d+', '/{id}', path)
+                if self.random.random() < self.error_rate:
+                    status, headers, payload = self.error_status, {}, \
+                        self._fault(self.error_status, 'Injected error')
+                else:
+                    status, headers, payload = self._nova(request.method, path, query, body)
+            self.calls['{} {}'.format(request.method, route)] += 1
+
+        return self._response(request, status, headers, payload)
+
+    def _response(self, request, status, headers, payload):
+        resp = requests.Response()
+        resp.status_code = status
+        resp.reason = requests.status_codes._codes.get(status, ('',))[0].upper()
+        resp.headers = CaseInsensitiveDict(headers)
+        resp.headers.setdefault('Content-Type', 'application/json')
+        resp._content = json.dumps(payload) if payload is not None else ''
+        resp.encoding = 'utf-8'
+        resp.request = request
+        resp.url = request.url
+        return resp
+
+    def _fault(self, code, message):
+        kind = {400: 'badRequest', 403: 'forbidden', 404: 'itemNotFound',
+                413: 'overLimit', 429: 'overLimit', 500: 'computeFault',
+                503: 'serviceUnavailable'}.get(code, 'computeFault')
+        return {kind: {'code': code, 'message': message}}
+
+    ############################################################ keystone
+
+    def _keystone(self, method, path, body):
+        route = path
+        if method == 'POST' and path == '/v3/auth/tokens':
+            expires = timestamp(time.time() + 3600)
+            token = {
+                'methods': ['password'],
+                'expires_at': expires,
+                'issued_at': timestamp(time.time()),
+                'user': {'id': 'fakeuser', 'name': 'fakeuser',
+                         'domain': {'id': 'default', 'name': 'Default'}},
+                'project': {'id': PROJECT_ID, 'name': 'fakeproject',
+                            'domain': {'id': 'default', 'name': 'Default'}},
+                'catalog': [{
+                    'type': 'compute', 'name': 'nova', 'id': 'nova',
+                    'endpoints': [
+                        {'id': 'nova-' + interface, 'interface': interface,
+                         'region': 'RegionOne', 'region_id': 'RegionOne',
+                         'url': '{}/{}'.format(NOVA_URL, PROJECT_ID)}
+                        for interface in ('public', 'internal', 'admin')],
+                }],
+            }
+            return route, 201, {'X-Subject-Token': uuid.uuid4().hex}, {'token': token}
+        if method == 'GET' and path.rstrip('/') == '/v3':
+            version = {'id': 'v3.4', 'status': 'stable',
+                       'updated': '2015-03-30T00:00:00Z',
+                       'links': [{'rel': 'self', 'href': KEYSTONE_URL + '/'}],
+                       'media-types': [{'base': 'application/json',
+                                        'type': 'application/vnd.openstack.identity-v3+json'}]}
+            return route, 200, {}, {'version': version}
+        return route, 404, {}, {'error': {'code': 404, 'message': 'Not found'}}
+
+    ############################################################ nova
+
+    def _nova(self, method, path, query, body):
+
+        now = time.time()
+        for server in self.servers.values():
+            server.refresh(now)
+            if server.deleted_at is not None and now >= server.deleted_at:
+                self._remove(server)
+
+        parts = path.strip('/').split('/')
+        handler = getattr(self, '_nova_' + parts[0].replace('-', '_'), None)
+        if handler is None:
+            return 404, {}, self._fault(404, 'No route for ' + path)
+        return handler(method, parts[1:], query, body)
+
+    def _nova_images(self, method, parts, query, body):
+        images = [{'id': ident, 'name': name, 'status': 'ACTIVE', 'links': []}
+                  for ident, name in self.images.iteritems()]
+        return 200, {}, {'images': images}
+
+    def _nova_flavors(self, method, parts, query, body):
+        flavors = [{'id': ident, 'name': name, 'ram': 2048, 'vcpus': 1,
+                    'disk': 20, 'links': []}
+                   for ident, name in self.flavors.iteritems()]
+        return 200, {}, {'flavors': flavors}
+
+    def _nova_os_networks(self, method, parts, query, body):
+        networks = [{'id': ident, 'label': label}
+                    for ident, label in self.networks.iteritems()]
+        return 200, {}, {'networks': networks}
+
+    def _nova_os_keypairs(self, method, parts, query, body):
+        if method == 'GET':
+            keypairs = [{'keypair': keypair} for keypair in self.keypairs.itervalues()]
+            return 200, {}, {'keypairs': keypairs}
+        keypair = dict(body['keypair'], fingerprint='fa:ke')
+        self.keypairs[keypair['name']] = keypair
+        return 200, {}, {'keypair': keypair}
+
+    def _nova_os_floating_ips(self, method, parts, query, body):
+
+        if method == 'GET':
+            return 200, {}, {'floating_ips': self.floating_ips.values()}
+
+        if method == 'POST':
+            limit = self.quotas.get('floating_ips')
+            if limit is not None and len(self.floating_ips) >= limit:
+                return 403, {}, self._fault(403, 'Quota exceeded for floating ips')
+            pool = (body or dict()).get('pool') or self.floating_ip_pools[0]
+            ident = str(next(self._ids))
+            n = len(self.floating_ips) + 1
+            fip = {'id': ident, 'ip': '172.16.{}.{}'.format(n // 250, n % 250 + 1),
+                   'pool': pool, 'instance_id': None, 'fixed_ip': None}
+            self.floating_ips[ident] = fip
+            return 200, {}, {'floating_ip': fip}
+
+        if method == 'DELETE':
+            if self.floating_ips.pop(parts[0], None) is None:
+                return 404, {}, self._fault(404, 'Floating ip not found')
+            return 202, {}, None
+
+        return 405, {}, self._fault(400, 'Unsupported')
+
+    def _nova_servers(self, method, parts, query, body):
+
+        if method == 'GET' and parts in ([], ['detail']):
+            servers = self.servers.values()
+            if 'name' in query:
+                pattern = re.compile(query['name'])
+                servers = [s for s in servers if pattern.search(s.name)]
+            if 'changes-since' in query:
+                since = query['changes-since']
+                servers = [s for s in servers if timestamp(s.updated) >= since]
+            return 200, {}, {'servers': [s.to_json() for s in servers]}
+
+        if method == 'POST' and not parts:
+            return self._create_servers(body['server'])
+
+        server = self.servers.get(parts[0]) if parts else None
+        if server is None:
+            return 404, {}, self._fault(404, 'Instance could not be found')
+
+        if method == 'GET':
+            return 200, {}, {'server': server.to_json()}
+
+        if method == 'PUT':
+            server.name = body['server'].get('name', server.name)
+            server.touch()
+            return 200, {}, {'server': server.to_json()}
+
+        if method == 'DELETE':
+            if self.delete_time > 0:
+                server.task_state = 'deleting'
+                server.deleted_at = time.time() + self.delete_time
+                server.touch()
+            else:
+                self._remove(server)
+            return 204, {}, None
+
+        if method == 'POST' and parts[1:] == ['action']:
+            return self._server_action(server, body)
+
+        return 405, {}, self._fault(400, 'Unsupported')
+
+    def _create_servers(self, spec):
+
+        count = int(spec.get('max_count') or spec.get('min_count') or 1)
+
+        limit = self.quotas.get('instances')
+        if limit is not None and len(self.servers) + count > limit:
+            return 403, {}, self._fault(403, 'Quota exceeded for instances')
+
+        if spec['imageRef'] not in self.images:
+            return 400, {}, self._fault(400, 'Invalid imageRef')
+        if spec['flavorRef'] not in self.flavors:
+            return 400, {}, self._fault(400, 'Invalid flavorRef')
+
+        nets = [nic.get('uuid') for nic in spec.get('networks', [])]
+        network = self.networks.get(nets[0]) if nets else self.networks.values()[0]
+        if network is None:
+            return 400, {}, self._fault(400, 'Invalid network')
+
+        created = None
+        for i in xrange(1, count + 1):
+            name = spec['name'] if count == 1 else '{}-{}'.format(spec['name'], i)
+            n = next(self._addresses)
+            created = _Server(
+                ident=self._uuid(), name=name,
+                image=spec['imageRef'], flavor=spec['flavorRef'],
+                key_name=spec.get('key_name'), network=network,
+                ip='10.0.{}.{}'.format(n // 250, n % 250 + 1),
+                ready_at=time.time() + max(0, self.active_time()),
+                fails=self.random.random() < self.build_failure_rate)
+            self.servers[created.id] = created
+
+        return 202, {}, {'server': {'id': created.id, 'links': [],
+                                    'adminPass': 'fake'}}
+
+    def _remove(self, server):
+        del self.servers[server.id]
+        for fip in self.floating_ips.itervalues():
+            if fip['instance_id'] == server.id:
+                fip['instance_id'] = fip['fixed_ip'] = None
+
+    def _server_action(self, server, body):
+
+        action, args = body.items()[0]
+
+        if action == 'addSecurityGroup':
+            if args['name'] not in server.security_groups:
+                server.security_groups.append(args['name'])
+            server.touch()
+            return 202, {}, None
+
+        if action == 'addFloatingIp':
+            for fip in self.floating_ips.itervalues():
+                if fip['ip'] == args['address']:
+                    if fip['instance_id'] not in (None, server.id):
+                        return 400, {}, self._fault(400, 'Floating ip is in use')
+                    fip['instance_id'] = server.id
+                    fip['fixed_ip'] = server.ip
+                    if fip['ip'] not in server.floating_ips:
+                        server.floating_ips.append(fip['ip'])
+                    server.touch()
+                    return 202, {}, None
+            return 404, {}, self._fault(404, 'Floating ip not found')
+
+        return 400, {}, self._fault(400, 'Unsupported action ' + action)
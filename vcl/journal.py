@@ -0,0 +1,132 @@
+"""
+Crash-safe record of the boot phases completed by each node
+"""
+
+import json
+import os
+import threading
+
+
+class Journal(object):
+    """Append-only journal of per-node boot phases
+
+    Each completed phase is appended to `path` as a single JSON line
+    and flushed immediately, so that the journal survives the boot
+    being interrupted at any point.  With `resume` the phases already
+    recorded in `path` are loaded, otherwise they are not used.  New
+    phases are appended in either case: the file is never truncated,
+    so that eg `vcl destroy` still sees what an earlier boot did.
+
+    Recording that a node was 'created' discards its earlier phases,
+    which belong to a previous server of that name.
+
+    If `path` is None the journal is only kept in memory.
+
+    The phases of a node are, in order: 'created', 'active',
+    'secgroups', 'floating_ip' and 'ip'.
+    """
+
+    PHASES = ('created', 'active', 'secgroups', 'floating_ip', 'ip')
+
+    def __init__(self, path=None, resume=False):
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = dict()
+        self._fd = None
+
+        if path is None:
+            return
+
+        if resume and os.path.exists(path):
+            self._load()
+        self._fd = open(path, 'a')
+        self._terminate_torn_line()
+
+    def _load(self):
+        with open(self.path) as fd:
+            for line in fd:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line may be incomplete after a crash
+                    continue
+                self._set(entry['node'], entry['phase'], entry.get('data', dict()))
+
+    def _set(self, node, phase, data):
+        if phase == 'created':
+            self._state[node] = dict()
+        self._state.setdefault(node, dict())[phase] = data
+
+    def _terminate_torn_line(self):
+        if os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, 'rb') as fd:
+            fd.seek(-1, os.SEEK_END)
+            last = fd.read(1)
+        if last != '\n':
+            self._fd.write('\n')
+
+    def done(self, node, phase):
+        """str -> str -> bool"""
+        with self._lock:
+            return phase in self._state.get(node, ())
+
+    def get(self, node, phase):
+        """str -> str -> dict or None
+
+        The data recorded with `phase` for `node`, if it was completed
+        """
+        with self._lock:
+            return self._state.get(node, dict()).get(phase)
+
+    def record(self, node, phase, **data):
+        """Record that `node` completed `phase`"""
+
+        assert phase in self.PHASES, phase
+
+        with self._lock:
+            self._set(node, phase, data)
+            if self._fd is not None:
+                entry = dict(node=node, phase=phase, data=data)
+                self._fd.write(json.dumps(entry) + '\n')
+                self._fd.flush()
+
+    def forget(self, nodes):
+        """Remove everything recorded for `nodes`
+
+        The journal file is rewritten without their entries.
+        """
+
+        nodes = set(nodes)
+
+        with self._lock:
+            for node in nodes:
+                self._state.pop(node, None)
+
+            if self._fd is None:
+                return
+
+            self._fd.close()
+            tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(self.path) as src, open(tmp, 'w') as dst:
+                for line in src:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry['node'] not in nodes:
+                        dst.write(json.dumps(entry) + '\n')
+            os.rename(tmp, self.path)
+            self._fd = open(self.path, 'a')
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                self._fd.close()
+                self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
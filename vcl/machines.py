@@ -0,0 +1,244 @@
+"""
+Reading and writing the machines file
+
+Next to the machines file `path` a sidecar index `path.idx` maps each
+hostname to its record, sorted by hostname, so that a single machine
+can be looked up without parsing the whole (YAML) machines file.  The
+index is rebuilt whenever the machines file's mtime or size no longer
+match the ones it was built from.
+"""
+
+import json
+import os
+
+from vcl.namespace import mk_namespace
+
+
+def _yaml():
+    # yaml is only needed when the index is (re)built
+    import yaml
+    try:
+        from yaml import CDumper as Dumper, CLoader as Loader
+    except ImportError:
+        from yaml import Dumper, Loader
+    return yaml, Dumper, Loader
+
+
+def load_machines(path):
+    yaml, _, Loader = _yaml()
+    d = yaml.load(open(path).read(), Loader=Loader)
+    return mk_namespace(d)
+
+
+INDEX_VERSION = 1
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+def _index_header(st):
+    return dict(version=INDEX_VERSION, mtime=st.st_mtime, size=st.st_size)
+
+
+def write_index(path, records):
+    """str -> {str: dict} -> ()
+
+    Write the index of the machines file `path`, which must contain
+    exactly `records`.  The index is written atomically.  Failing to
+    write it (eg in a read-only directory) is not an error.
+    """
+
+    header = _index_header(os.stat(path))
+    dest = index_path(path)
+    tmp = '{}.{}.tmp'.format(dest, os.getpid())
+
+    lines = []
+    for hostname, record in records.iteritems():
+        if isinstance(hostname, unicode):
+            hostname = hostname.encode('utf-8')
+        assert '\t' not in hostname and '\n' not in hostname, hostname
+        lines.append('{}\t{}\n'.format(hostname, json.dumps(record)))
+    lines.sort()
+
+    try:
+        with open(tmp, 'w') as fd:
+            fd.write(json.dumps(header) + '\n')
+            fd.writelines(lines)
+        os.rename(tmp, dest)
+    except (IOError, OSError):
+        pass
+
+
+class MachinesIndex(object):
+    """Look up machines through the index of the machines file
+
+    >>> with MachinesIndex('.machines.yml') as machines:
+    ...     node = machines['master0']
+    ...     hostnames = list(machines.hostnames())
+
+    The index is memory mapped and searched with a binary search over
+    its lines, so a lookup does not depend on the number of machines.
+    If it is missing or stale it is rebuilt from the machines file
+    first.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._mm = None
+        self._start = None
+        self._machines = None
+
+    def _fresh(self, fd):
+        try:
+            header = json.loads(fd.readline())
+        except ValueError:
+            return False
+        return header == _index_header(os.stat(self.path))
+
+    def _rebuild(self):
+        machines = load_machines(self.path) or dict()
+        write_index(self.path, machines)
+        return machines
+
+    def open(self):
+        import mmap
+
+        try:
+            fd = open(index_path(self.path), 'rb')
+        except IOError:
+            fd = None
+
+        if fd is None or not self._fresh(fd):
+            if fd is not None:
+                fd.close()
+            machines = self._rebuild()
+            try:
+                fd = open(index_path(self.path), 'rb')
+            except IOError:
+                fd = None
+            if fd is None or not self._fresh(fd):
+                # the index could not be written, or the machines file
+                # changed in the meantime: use what was just loaded
+                if fd is not None:
+                    fd.close()
+                self._machines = machines
+                return self
+
+        self._fd = fd
+        self._start = fd.tell()
+        self._mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        return self
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._fd.close()
+            self._mm = self._fd = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _find(self, hostname):
+        mm, lo, hi = self._mm, self._start, len(self._mm)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            line_start = max(mm.rfind('\n', lo, mid) + 1, lo)
+            line_end = mm.find('\n', line_start)
+            tab = mm.find('\t', line_start, line_end)
+            name = mm[line_start:tab]
+            if name == hostname:
+                return mm[tab + 1:line_end]
+            elif name < hostname:
+                lo = line_end + 1
+            else:
+                hi = line_start
+        return None
+
+    def get(self, hostname, default=None):
+        """str -> Namespace or `default`"""
+        if isinstance(hostname, unicode):
+            hostname = hostname.encode('utf-8')
+        if self._machines is not None:
+            return self._machines.get(hostname, default)
+        record = self._find(hostname)
+        if record is None:
+            return default
+        return mk_namespace(json.loads(record))
+
+    def __getitem__(self, hostname):
+        node = self.get(hostname)
+        if node is None:
+            raise KeyError(hostname)
+        return node
+
+    def __contains__(self, hostname):
+        return self.get(hostname) is not None
+
+    def hostnames(self):
+        """Generate the hostnames, in sorted order"""
+        if self._machines is not None:
+            for hostname in sorted(self._machines):
+                yield hostname
+            return
+        mm = self._mm
+        pos = self._start
+        end = len(mm)
+        while pos < end:
+            tab = mm.find('\t', pos)
+            yield mm[pos:tab]
+            pos = mm.find('\n', tab) + 1
+
+
+class MachinesWriter(object):
+    """Stream booted nodes to the machines file
+
+    The nodes are written through a single buffered handle to a
+    temporary file next to `path`, flushed after each node, and the
+    file is renamed over `path` when the writer is closed.  Readers of
+    `path` therefore never see a partially written file.  The index of
+    the file is written along with it.
+
+    >>> with MachinesWriter('.machines.yml') as writer:
+    ...     for node in nodes:
+    ...         writer.write(node)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._tmp = '{}.{}.tmp'.format(path, os.getpid())
+        self._fd = None
+        self._records = dict()
+
+    def open(self):
+        self._fd = open(self._tmp, 'w')
+        return self
+
+    def write(self, node):
+        """Node -> ()"""
+        yaml, Dumper, _ = _yaml()
+        record = node.to_simple_types()
+        o = {node.hostname: record}
+        yaml.dump(o, self._fd, Dumper=Dumper, default_flow_style=False)
+        self._fd.flush()
+        self._records[node.hostname] = record
+
+    def close(self):
+        """Close the file and move it into place"""
+        if self._fd is None:
+            return
+        self._fd.close()
+        self._fd = None
+        os.rename(self._tmp, self.path)
+        write_index(self.path, self._records)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        # keep whatever was written, even if booting failed part way
+        self.close()
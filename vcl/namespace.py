@@ -0,0 +1,25 @@
+from easydict import EasyDict
+
+
+def mk_namespace(spec_dict):
+    """dict -> Namespace
+
+    Provides a nice dotted attribute access to the elements of a
+    dictionary.
+
+    eg:
+    >>> s = mk_namespace({'foo':{'bar': 42}, baz = 24})
+    >>> s.foo.bar
+    42
+    >>> s.baz
+    24
+    """
+
+    def mk(obj):
+        for k in obj.iterkeys():
+            v = obj[k]
+            if isinstance(v, dict):
+                obj[k] = mk(obj[k])
+        return EasyDict(**obj)
+
+    return mk(spec_dict)
@@ -3,7 +3,10 @@ import novaclient
 import novaclient.exceptions
 
 from pxul.os import fullpath
+from vcl.events import EventLog
+from vcl.journal import Journal
 import sys
+import threading
 
 
 # ignore the urllib3 SecurityWarnings
@@ -12,9 +15,27 @@ import warnings
 warnings.simplefilter('ignore')
 
 
-def get_client():
-    from keystoneclient.session import Session
+def get_client(token_cache=None, pool_size=10, retries=5, rate=None,
+               http_session=None, events=None):
+    """bool or None -> int -> int -> float or None -> requests.Session or None -> EventLog or None -> novaclient.client.Client
+
+    With `token_cache` (default: if $VCL_TOKEN_CACHE is set to 1, yes
+    or true) the Keystone token and service catalog are cached on disk
+    between invocations, keyed by the auth url, user and project.
+
+    The client keeps up to `pool_size` connections open, retries
+    failed requests up to `retries` times (see
+    `vcl.session.RetryingSession`) and, if `rate` is given, makes at
+    most `rate` requests per second.
+
+    The requests are sent through `http_session` if given, eg to talk
+    to a `vcl.fakecloud.FakeCloud`, instead of a new pooled session.
+    They are recorded in `events` (a `vcl.events.EventLog`) if given.
+    """
+
     from novaclient.client import Client
+    from vcl.session import RetryingSession, pooled_session
+    from vcl.ratelimit import TokenBucket
     from os import getenv as ge
     from keystoneclient.auth.identity import Password
 
@@ -28,6 +49,7 @@ def get_client():
             password=ge('OS_PASSWORD'),
             tenant_name=ge('OS_TENANT_NAME')
         )
+        project = [ge('OS_TENANT_NAME')]
     elif OS_AUTH_URL.endswith('v3'):
         auth = Password(
             ge('OS_AUTH_URL'),
@@ -37,20 +59,67 @@ def get_client():
             project_domain_id=ge('OS_PROJECT_DOMAIN_ID', 'default'),
             project_name=ge('OS_PROJECT_NAME'),
         )
+        project = [ge('OS_USER_DOMAIN_ID', 'default'),
+                   ge('OS_PROJECT_DOMAIN_ID', 'default'),
+                   ge('OS_PROJECT_NAME')]
     else:
         raise ValueError('Unable to discover version from {}'.format(OS_AUTH_URL))
 
+    if token_cache is None:
+        token_cache = ge('VCL_TOKEN_CACHE', '').lower() in ('1', 'yes', 'true')
+
+    if token_cache:
+        import atexit
+        from vcl.tokencache import TokenCache
 
-    session = Session(
+        cache = TokenCache.for_credentials(OS_AUTH_URL, ge('OS_USERNAME'), *project)
+        cache.load(auth)
+        atexit.register(cache.save, auth)
+
+
+    session = RetryingSession(
         auth=auth,
         verify=ge('OS_CACERT'),
+        session=http_session or pooled_session(pool_size),
+        retries=retries,
+        rate_limiter=TokenBucket(rate) if rate else None,
     )
 
+    if events is not None:
+        events.watch(session)
+
     client = Client('2', session=session)
     return client
 
 
 
+def repeatable(func, retries=5, backoff=0.5, max_backoff=30):
+    """(() -> a) -> int -> float -> float -> a
+
+    Call `func`, which makes a request that is safe to repeat, again if
+    it fails with a server error (5xx), up to `retries` times.
+
+    The session does not retry a POST failing with a 500, 502 or 504
+    itself, as the server may have acted on it.  Some POSTs can be
+    repeated regardless, eg adding a server to a security group or
+    associating a floating ip with it: doing it twice has the same
+    effect as doing it once.
+    """
+
+    import time
+    from vcl.session import backoff_delay
+
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except novaclient.exceptions.ClientException as e:
+            if not isinstance(e.code, int) or e.code < 500 or attempt >= retries:
+                raise
+        time.sleep(backoff_delay(attempt, backoff, max_backoff))
+        attempt += 1
+
+
 def find_by_query(objects, ident, query='name'):
     objects = [
         obj for obj in objects
@@ -61,70 +130,513 @@ def find_by_query(objects, ident, query='name'):
     return objects[0]
 
 
-def wait_until(expr, sleep_time=1, max_time=60):
-    import time
-    slept = 0
-    while not expr():
-        msg = '{} / {}'.format(slept+sleep_time, max_time)
-        sys.stdout.write(msg)
+class Catalog(object):
+    """Per-run cache of the image, flavor, network and keypair catalogs
+
+    Each collection is listed once, on first use, and indexed by name
+    (or label for networks) so that looking up the same entry for
+    every node is a dictionary access instead of a full listing.
+    """
+
+    def __init__(self, nova):
+        self._nova = nova
+        self._lock = threading.RLock()
+        self._indices = dict()
+
+    def _index(self, collection, attr):
+        with self._lock:
+            if collection not in self._indices:
+                index = dict()
+                for obj in getattr(self._nova, collection).list():
+                    index.setdefault(getattr(obj, attr), []).append(obj)
+                self._indices[collection] = index
+            return self._indices[collection]
+
+    def _find(self, collection, attr, ident):
+        matches = self._index(collection, attr).get(ident, [])
+        if not matches:
+            raise novaclient.exceptions.NotFound(
+                404, 'No {} with {} {}'.format(collection, attr, ident))
+        elif len(matches) > 1:
+            raise novaclient.exceptions.NoUniqueMatch()
+        return matches[0]
+
+    def image(self, name):
+        return self._find('images', 'name', name)
+
+    def flavor(self, name):
+        return self._find('flavors', 'name', name)
+
+    def network(self, label):
+        return self._find('networks', 'label', label)
+
+    def keypair(self, name):
+        return self._find('keypairs', 'name', name)
+
+    def add_keypair(self, name, public_key):
+        """str -> str -> bool
+
+        Upload the public key at path `public_key` as `name` unless a
+        keypair of that name already exists.  Returns True if the key
+        was uploaded.
+        """
+
+        with self._lock:
+            keypairs = self._index('keypairs', 'name')
+            if name in keypairs:
+                return False
+
+            key = open(fullpath(public_key)).read()
+            keypairs[name] = [self._nova.keypairs.create(name, key)]
+            return True
+
+
+class FloatingIPPool(object):
+    """Local free-list of the project's floating ips
+
+    The floating ips are listed once, on first use, and the unassigned
+    ones are kept per pool.  Addresses are handed out under a lock so
+    concurrent boot workers never get the same one.  If a pool runs
+    dry a new address is allocated from it.
+
+    The addresses allocated by this object are recorded in `allocated`.
+    Allocations failing with a server error are tried again up to
+    `retries` times.  If the first attempt did allocate an address it
+    is left unassigned in the project, where the next run picks it up.
+    """
+
+    def __init__(self, nova, retries=5):
+        self._nova = nova
+        self.retries = retries
+        self._lock = threading.Lock()
+        self._free = None
+        self.allocated = []
+
+    def _load(self):
+        if self._free is None:
+            self._free = dict()
+            for floating_ip in self._nova.floating_ips.list():
+                if floating_ip.instance_id is None:
+                    self._free.setdefault(floating_ip.pool, []).append(floating_ip)
+
+    def _allocate(self, pool):
+        floating_ip = repeatable(lambda: self._nova.floating_ips.create(pool=pool),
+                                 retries=self.retries)
+        self.allocated.append(floating_ip.ip)
+        return floating_ip
+
+    def reserve(self, count, pool):
+        """int -> str -> int
+
+        Make sure at least `count` addresses from `pool` are free,
+        allocating the shortfall up front.  Returns the number of
+        addresses allocated.
+        """
+
+        with self._lock:
+            self._load()
+            free = self._free.setdefault(pool, [])
+            shortfall = max(0, count - len(free))
+            for _ in xrange(shortfall):
+                free.append(self._allocate(pool))
+            return shortfall
+
+    def acquire(self, pool):
+        """str -> (FloatingIP, bool)
+
+        Take a free address from `pool`, allocating one if none are
+        left.  Returns the address and whether it was newly allocated.
+        """
+
+        with self._lock:
+            self._load()
+            free = self._free.setdefault(pool, [])
+            if free:
+                return free.pop(0), False
+            else:
+                return self._allocate(pool), True
+
+
+class ServerIndex(object):
+    """The project's servers, listed once and indexed by name
+
+    Only servers whose name starts with `prefix` are listed.
+    """
+
+    def __init__(self, nova, prefix=''):
+        import re
+
+        search_opts = {'name': '^' + re.escape(prefix)} if prefix else None
+
+        self._by_name = dict()
+        self._by_id = dict()
+        for server in nova.servers.list(search_opts=search_opts):
+            self._by_name.setdefault(server.name, []).append(server)
+            self._by_id[server.id] = server
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def __iter__(self):
+        for servers in self._by_name.itervalues():
+            for server in servers:
+                yield server
+
+    def __len__(self):
+        return sum(map(len, self._by_name.itervalues()))
+
+    def all(self, name):
+        """str -> [Server]"""
+        return list(self._by_name.get(name, []))
+
+    def get(self, name):
+        """str -> Server or None"""
+        servers = self._by_name.get(name, [])
+        if len(servers) > 1:
+            raise novaclient.exceptions.NoUniqueMatch()
+        return servers[0] if servers else None
+
+    def by_id(self, ident):
+        """str -> Server or None"""
+        return self._by_id.get(ident)
+
+
+def server_addresses(server, net_name, kind):
+    return [
+        a['addr']
+        for a in server.addresses.get(net_name, [])
+        if a['OS-EXT-IPS:type'] == kind
+    ]
+
+
+def fixed_ip(server, net_name):
+    """Server -> str -> str
+
+    The internal ip of `server` on network `net_name`
+    """
+
+    fixed_addresses = server_addresses(server, net_name, 'fixed')
+    assert len(fixed_addresses) == 1, fixed_addresses
+    return fixed_addresses[0]
+
+
+def floating_ip(server, net_name):
+    """Server -> str -> str or None
+
+    The floating ip of `server` on network `net_name`, if any
+    """
+
+    floating_addresses = server_addresses(server, net_name, 'floating')
+    return floating_addresses[0] if floating_addresses else None
+
+
+class StatusPoller(object):
+    """Shared status tracker for servers that are being booted
+
+    Rather than polling every server with its own `servers.get`, all
+    pending servers are refreshed together with a single detailed
+    `servers.list`.  After the first listing only servers changed since
+    the last one are requested (`changes-since`) if the cloud supports
+    it.  The time between listings backs off from `sleep_time` up to
+    `max_sleep_time` while nothing changes and drops back once
+    something does.
+
+    Only one waiting thread polls at a time, the others wait for its
+    results.  The latest details of each server, including its
+    addresses, are kept and can be retrieved with `get`.
+
+    Statuses are only taken from the responses themselves: accessing
+    an attribute that a novaclient `Server` was returned without (eg
+    the `status` of a `servers.create` response) would fetch the
+    server with a GET.
+    """
+
+    FINAL = ('ACTIVE', 'ERROR', 'DELETED')
+
+    def __init__(self, nova, sleep_time=1, max_sleep_time=None, backoff=1.5):
+        self._nova = nova
+        self._cond = threading.Condition()
+        self._servers = dict()
+        self._status = dict()
+        self._pending = set()
+        self._polling = False
+        self._since = None
+        self._changes_since = True
+
+        self.sleep_time = sleep_time
+        self.max_sleep_time = max_sleep_time or 10 * sleep_time
+        self.backoff = backoff
+        self._sleep = sleep_time
+
+    def track(self, server):
+        """Start tracking `server`, eg as returned by `servers.create`
+
+        Tracking a server again keeps the details already seen, which
+        may be more recent than `server`'s.
+        """
+        with self._cond:
+            if server.id not in self._servers:
+                self._servers[server.id] = server
+                self._status[server.id] = status = server._info.get('status')
+                if status not in self.FINAL:
+                    # the server may have changed before the listings
+                    # that already moved the cursor past its update
+                    self._since = None
+            self._pending.add(server.id)
+            self._sleep = self.sleep_time
+
+    def get(self, server_id):
+        """The most recently seen details of a tracked server"""
+        with self._cond:
+            return self._servers[server_id]
+
+    def _list(self):
+        if self._since and self._changes_since:
+            try:
+                return self._nova.servers.list(
+                    search_opts={'changes-since': self._since})
+            except novaclient.exceptions.BadRequest:
+                self._changes_since = False
+        return self._nova.servers.list()
+
+    def refresh(self):
+        """() -> int
+
+        Refresh all tracked servers with a single listing.  Returns the
+        number of pending servers whose status changed.
+        """
+
+        servers = self._list()
+
+        with self._cond:
+            changed = 0
+            for server in servers:
+                # use the cloud's timestamps rather than ours to avoid
+                # missing updates due to clock skew
+                updated = getattr(server, 'updated', None)
+                if updated and (self._since is None or updated > self._since):
+                    self._since = updated
+
+                if server.id not in self._servers:
+                    continue
+
+                status = server._info.get('status')
+                old = self._status.get(server.id)
+                self._servers[server.id] = server
+                self._status[server.id] = status
+                if server.id in self._pending and status != old:
+                    changed += 1
+
+            if changed:
+                self._sleep = self.sleep_time
+            else:
+                self._sleep = min(self._sleep * self.backoff,
+                                  self.max_sleep_time)
+
+            return changed
+
+    def wait(self, server_id, status='ACTIVE', max_time=60):
+        """str -> str -> int -> Server
+
+        Block until the tracked server reaches `status` and return its
+        details.  Raises RuntimeError if the server goes into ERROR or
+        does not reach `status` within `max_time` seconds.
+        """
+
+        import time
+        deadline = time.time() + max_time
+
+        with self._cond:
+            while True:
+                current = self._status.get(server_id)
+
+                if current == status:
+                    self._pending.discard(server_id)
+                    return self._servers[server_id]
+
+                elif current in ('ERROR', 'DELETED'):
+                    self._pending.discard(server_id)
+                    raise RuntimeError, 'Server {} is {}'.format(server_id, current)
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._pending.discard(server_id)
+                    raise RuntimeError, 'Timeout while waiting for {} to become {}'\
+                        .format(server_id, status)
+
+                if self._polling:
+                    # someone else is polling: wait for their results
+                    self._cond.wait(remaining)
+                    continue
+
+                self._polling = True
+                sleep = min(self._sleep, remaining)
+                self._cond.release()
+                try:
+                    time.sleep(sleep)
+                    self.refresh()
+                finally:
+                    self._cond.acquire()
+                    self._polling = False
+                    self._cond.notify_all()
+
+
+_print_lock = threading.Lock()
+
+def say(tag, msg):
+    """Print `msg` as a single line, prefixed with `tag` if given.
+
+    Safe to call from several boot workers at once.
+    """
+    line = '[{}] {}'.format(tag, msg) if tag else msg
+    with _print_lock:
+        sys.stdout.write(line + '\n')
         sys.stdout.flush()
-        sys.stdout.write('\b' * len(msg))
-        time.sleep(sleep_time)
-        slept += sleep_time
-        if slept >= max_time:
-            print(msg + ' Timed out')
-            raise RuntimeError, 'Timeout while waiting for {}'.format(expr)
-    print(msg + '...done')
 
 
+def boot_node(nova, node, prefix='', dry_run=False,
+              waitForActiveSleep=1,
+              waitForActiveTimeout=60,
+              tag=None,
+              catalog=None,
+              poller=None,
+              created=None,
+              floating_ips=None,
+              servers=None,
+              journal=None,
+              events=None,
+              retries=5):
+    """Client -> Node -> ... -> Node or None
 
-def boot(nodes, prefix='', dry_run=False,
-         waitForActiveSleep=1,
-         waitForActiveTimeout=60,
-         **kws):
+    Run the boot pipeline for a single node: upload the key, create
+    the server, wait until it is ACTIVE, add the security groups and
+    floating ip and discover the internal ip.
 
-    nova = get_client()
+    Images, flavors, networks and keypairs are looked up in `catalog`
+    and the server status is tracked by `poller`.  Floating ips are
+    taken from `floating_ips` and `servers` indexes the servers that
+    existed before the run.  These should be shared between the nodes
+    of a run.
 
-    for node in nodes:
-        node_name = prefix + node.hostname
-        print node.hostname, '->', node_name
+    If the node's server has already been created (see `create_batch`)
+    it should be in `created`, keyed by name.
 
-        image_name = node.image
-        flavor_name = node.flavor
-        key_name = node.key_name
-        net_name = node.network
-        sec_groups = node.security_groups
+    Each completed phase is recorded in `journal`.  Phases the journal
+    already has for the node are skipped, so an interrupted boot can
+    be resumed where it stopped, unless the server they were recorded
+    for no longer exists.
 
-        if dry_run:
-            yield node
-            continue
+    If a server of the same name already exists, but not in the
+    journal, it is not touched and the node's addresses are filled in
+    from it once it is ACTIVE.  If it goes into ERROR or has no single
+    internal ip it is reported and the node is skipped: None is
+    returned instead of the node.
 
-        ################################################## upload key if needed
+    The duration of each phase is recorded in `events`.
 
-        try:
-            print('-> Looking for key {}'.format(key_name))
-            nova.keypairs.find(name=key_name)
-        except novaclient.exceptions.NotFound:
-            print('...not found, adding {} as {}'.format(node.public_key, key_name))
-            path = node.public_key
-            key  = open(fullpath(path)).read()
-            nova.keypairs.create(key_name, key)
+    Adding the server to its security groups and associating its
+    floating ip are repeated up to `retries` times if they fail with a
+    server error (see `repeatable`).
+    """
 
-        image = nova.images.find(name=image_name)
-        flavor = nova.flavors.find(name=flavor_name)
-        nics = [{'net-id': nova.networks.find(label=net_name).id}]
+    node_name = prefix + node.hostname
+    say(tag, '{} -> {}'.format(node.hostname, node_name))
 
+    if dry_run:
+        return node
 
-        ################################################## boot
+    catalog = catalog or Catalog(nova)
+    poller = poller or StatusPoller(nova, sleep_time=waitForActiveSleep)
+    floating_ips = floating_ips or FloatingIPPool(nova, retries=retries)
+    journal = journal or Journal()
+    events = events or EventLog()
+    if servers is None:
+        servers = ServerIndex(nova, prefix=prefix)
 
-        try:
-            print('-> Checking if already booted')
-            nova.servers.find(name=node_name)
-            print '...true'
-            continue
-        except novaclient.exceptions.NotFound:
+    image_name = node.image
+    flavor_name = node.flavor
+    key_name = node.key_name
+    net_name = node.network
+    sec_groups = node.security_groups
+
+    finished = journal.get(node_name, 'ip')
+    if finished is not None:
+        server = journal.get(node_name, 'created')
+        if server is not None:
+            server = servers.by_id(server['id'])
+        else:
+            server = servers.get(node_name)
+
+        if server is not None:
+            say(tag, '-> Already booted according to the journal')
+            node.ip = finished['ip']
+            if finished.get('floating_ip') is not None:
+                node.floating_ip = finished['floating_ip']
+            return node
+
+        say(tag, '-> The server in the journal is gone')
 
-            print('-> Creating {}'.format(node_name))
+
+    ################################################## boot
+
+    created = created or dict()
+
+    if node_name in created:
+        vm = created[node_name]
+        say(tag, '-> Created {} as part of a batch'.format(node_name))
+
+    elif journal.done(node_name, 'created') and \
+            servers.by_id(journal.get(node_name, 'created')['id']) is not None:
+        vm = servers.by_id(journal.get(node_name, 'created')['id'])
+        say(tag, '-> Resuming {}'.format(node_name))
+        if vm.name != node_name:
+            # created by a multi-create request that failed to rename it
+            say(tag, '...renaming {}'.format(vm.name))
+            vm.update(name=node_name)
+            vm.name = node_name
+
+    else:
+        say(tag, '-> Checking if already booted')
+        existing = servers.get(node_name)
+        if existing is not None:
+            say(tag, '...true')
+            if existing._info.get('status') not in StatusPoller.FINAL:
+                say(tag, '-> Waiting until ACTIVE')
+                poller.track(existing)
+                try:
+                    existing = poller.wait(existing.id, max_time=waitForActiveTimeout)
+                except RuntimeError as e:
+                    say(tag, 'WARNING skipping {}: {}'.format(node_name, e))
+                    return None
+            if existing._info.get('status') == 'ERROR':
+                say(tag, 'WARNING skipping {}: it is in ERROR'.format(node_name))
+                return None
+            fixed = server_addresses(existing, net_name, 'fixed')
+            if len(fixed) != 1:
+                say(tag, 'WARNING skipping {}: {} internal ips on {}'
+                    .format(node_name, len(fixed), net_name))
+                return None
+            node.ip = fixed[0]
+            floating = floating_ip(existing, net_name)
+            if floating is not None:
+                node.floating_ip = floating
+            journal.record(node_name, 'ip', ip=node.ip, floating_ip=floating)
+            return node
+
+        ############################################## upload key if needed
+
+        say(tag, '-> Looking for key {}'.format(key_name))
+        with events.phase(node_name, 'keypair'):
+            if catalog.add_keypair(key_name, node.public_key):
+                say(tag, '...not found, added {} as {}'.format(node.public_key, key_name))
+
+        with events.phase(node_name, 'catalog'):
+            image = catalog.image(image_name)
+            flavor = catalog.flavor(flavor_name)
+            nics = [{'net-id': catalog.network(net_name).id}]
+
+        say(tag, '-> Creating {}'.format(node_name))
+        with events.phase(node_name, 'create'):
             vm = nova.servers.create(
                 node_name,
                 image,
@@ -132,66 +644,609 @@ def boot(nodes, prefix='', dry_run=False,
                 key_name=key_name,
                 nics=nics
             )
+        # discards the phases of any previous server of the node
+        journal.record(node_name, 'created', id=vm.id)
+
+    if journal.done(node_name, 'active'):
+        instance = vm
+    else:
+        say(tag, '-> Waiting until ACTIVE')
+        with events.phase(node_name, 'wait'):
+            poller.track(vm)
+            instance = poller.wait(vm.id, max_time=waitForActiveTimeout)
+        journal.record(node_name, 'active')
+        say(tag, '...done')
+
+
+    ################################################## security groups
+
+    if not journal.done(node_name, 'secgroups'):
+        current = set(group['name']
+                      for group in getattr(instance, 'security_groups', []))
+        with events.phase(node_name, 'secgroups'):
+            for name in sec_groups:
+                if name in current:
+                    continue
+                say(tag, '-> Adding to security group {}'.format(name))
+                repeatable(lambda: vm.add_security_group(name), retries=retries)
+        journal.record(node_name, 'secgroups', names=list(sec_groups))
+
 
-        def is_active():
-            instance = nova.servers.get(vm.id)
-            return instance.status == 'ACTIVE'
+    ################################################## floating ip
 
-        print '-> Waiting until ACTIVE ',
-        wait_until(is_active, sleep_time=waitForActiveSleep, max_time=waitForActiveTimeout)
+    if journal.done(node_name, 'floating_ip'):
+        node.floating_ip = journal.get(node_name, 'floating_ip')['ip']
 
+    elif node.create_floating_ip:
+        say(tag, '-> Adding floating ip')
+        pool = node.floating_ip_pool
+        with events.phase(node_name, 'floating_ip'):
+            address, allocated = floating_ips.acquire(pool)
+            if allocated:
+                say(tag, '...allocated {} from pool {}'.format(address.ip, pool))
+            else:
+                say(tag, '...using {}'.format(address.ip))
 
-        ################################################## security groups
+            say(tag, '...associating')
+            repeatable(lambda: vm.add_floating_ip(address), retries=retries)
 
-        for name in sec_groups:
-            print('-> Adding to security group {}'.format(name))
-            vm.add_security_group(name)
+        # usefull for regenerating a spec file
+        node.floating_ip = address.ip
+        # node.set_dynamic('floating_ip', str(ip.ip))
+        journal.record(node_name, 'floating_ip', ip=address.ip,
+                       allocated=address.ip in floating_ips.allocated)
+        say(tag, '...done')
 
 
-        ################################################## floating ip
+    ################################################## internal ip
 
-        if node.create_floating_ip:
-            print('-> Adding floating ip')
+    say(tag, '-> Geting internal ip')
+    with events.phase(node_name, 'ip'):
+        node.ip = fixed_ip(instance, net_name)
+    journal.record(node_name, 'ip', ip=node.ip, floating_ip=node.floating_ip)
+    say(tag, '...done')
+
+    ################################################## extra discs
+
+    for disk in node.extra_disks:
+        # cinder not support yet
+        say(tag, 'WARNING extra disks not supported yet')
+        # node.unset_dynamic('extra_disks')
+
+    return node
+
+
+
+def concurrently(func, items, parallel):
+    """(a -> b) -> [a] -> int -> generator of b
+
+    Apply `func` to `items` on a pool of `parallel` threads, yielding
+    the results in order of completion
+    """
+
+    from multiprocessing.pool import ThreadPool
+    from multiprocessing import TimeoutError
+
+    pool = ThreadPool(max(1, parallel))
+    try:
+        results = pool.imap_unordered(func, items)
+        while True:
+            # poll with a timeout so that Ctrl-C is not swallowed
+            # while blocking on the workers
             try:
-                # first try to get a free ip
-                floating_ip = nova.floating_ips.findall(instance_id=None)[0]
-                print('...using {}'.format(floating_ip))
-            except IndexError:
-                pool = node.floating_ip_pool
-                floating_ip = nova.floating_ips.create(pool=pool)
-                print('...allocated {} from pool {}'.format(floating_ip, pool))
-
-            print('...associating')
-            vm.add_floating_ip(floating_ip)
-
-            # usefull for regenerating a spec file
-            node.floating_ip = floating_ip.ip
-            # node.set_dynamic('floating_ip', str(ip.ip))
-            print('...done')
-
-
-        ################################################## internal ip
-
-        print('-> Geting internal ip')
-        instance = nova.servers.get(vm.id)
-        addresses = instance.addresses[net_name]
-        fixed_addresses = [
-            a['addr']
-            for a in addresses
-            if a['OS-EXT-IPS:type'] == 'fixed'
-        ]
-        assert len(fixed_addresses) == 1, fixed_addresses
-        internal_ip = fixed_addresses[0]
-        node.ip = internal_ip
-        print('...done')
-
-        ################################################## extra discs
-
-        for disk in node.extra_disks:
-            # cinder not support yet
-            print 'WARNING extra disks not supported yet'
-            # node.unset_dynamic('extra_disks')
-
-
-        ################################################## save
-        yield node
+                result = results.next(0.5)
+            except TimeoutError:
+                continue
+            except StopIteration:
+                break
+
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def batch_key(node):
+    """Node -> tuple
+
+    The parameters that go into the create request for `node`.  Nodes
+    with the same key can be created together.
+    """
+    return (node.image, node.flavor, node.key_name, node.network)
+
+
+def homogeneous_batches(nodes):
+    """[Node] -> [[Node]]
+
+    Partition `nodes` into batches that can be created with a single
+    request, keeping the order of the nodes within each batch.
+    """
+
+    import collections
+
+    batches = collections.OrderedDict()
+    for node in nodes:
+        batches.setdefault(batch_key(node), []).append(node)
+    return batches.values()
+
+
+def create_batch(nova, nodes, prefix='', catalog=None, tag=None, journal=None,
+                 events=None, poller=None):
+    """Client -> [Node] -> ... -> {str: Server}
+
+    Create the servers for the homogeneous `nodes` with one multi-create
+    request, then rename each server after the node it is mapped to.
+
+    Nova names the servers of a multi-create request after the request
+    with a per-server suffix.  They are given a unique temporary name,
+    listed once and matched to `nodes` in order of that suffix.  Note
+    that the hostname the cloud hands to the instance is derived from
+    the temporary name.
+
+    The id of each server is recorded in `journal` before it is
+    renamed, so that a resumed boot finds it even if the rename did not
+    happen.  If creating or renaming the batch fails, the servers that
+    were not renamed yet are deleted and forgotten again.
+
+    The servers are tracked by `poller` as soon as they are listed, so
+    that their status is followed before their nodes are booted.
+
+    Returns the created servers keyed by their new name.
+    """
+
+    import re
+    import uuid
+
+    catalog = catalog or Catalog(nova)
+    journal = journal or Journal()
+    events = events or EventLog()
+    first = nodes[0]
+
+    batch = '{}vcl-{}'.format(prefix, uuid.uuid4().hex[:8])
+    count = len(nodes)
+
+    with events.phase(batch, 'keypair'):
+        if catalog.add_keypair(first.key_name, first.public_key):
+            say(tag, '...added {} as {}'.format(first.public_key, first.key_name))
+
+    with events.phase(batch, 'catalog'):
+        image = catalog.image(first.image)
+        flavor = catalog.flavor(first.flavor)
+        nics = [{'net-id': catalog.network(first.network).id}]
+
+    def index(server):
+        suffix = server.name.rsplit('-', 1)[-1]
+        return (0, int(suffix)) if suffix.isdigit() else (1, suffix)
+
+    created = dict()
+    try:
+        say(tag, '-> Creating {} x {} {} as {}'.format(count, first.flavor, first.image, batch))
+        with events.phase(batch, 'create', nodes=count):
+            nova.servers.create(
+                batch,
+                image,
+                flavor,
+                key_name=first.key_name,
+                nics=nics,
+                min_count=count,
+                max_count=count,
+            )
+
+            servers = nova.servers.list(search_opts={'name': '^{}-'.format(re.escape(batch))})
+
+        if len(servers) != count:
+            raise RuntimeError, 'Batch {} has {} servers instead of {}'\
+                .format(batch, len(servers), count)
+
+        names = [prefix + node.hostname for node in nodes]
+        servers = sorted(servers, key=index)
+        for name, server in zip(names, servers):
+            journal.record(name, 'created', id=server.id)
+            if poller is not None:
+                poller.track(server)
+
+        with events.phase(batch, 'rename', nodes=count):
+            for name, server in zip(names, servers):
+                server.update(name=name)
+                server.name = name
+                created[name] = server
+
+    except Exception:
+        error = sys.exc_info()
+        discard_batch(nova, batch, [prefix + node.hostname for node in nodes],
+                      keep=created.values(), journal=journal, tag=tag)
+        raise error[0], error[1], error[2]
+
+    return created
+
+
+def discard_batch(nova, batch, names, keep=(), journal=None, tag=None):
+    """Client -> str -> [str] -> ... -> ()
+
+    Delete the servers of the multi-create request `batch` that were
+    not renamed (those not in `keep`) and forget the journal entries of
+    `names` that point to them.  Failures are reported rather than
+    raised, so as not to hide the error that caused the cleanup.
+    """
+
+    import re
+
+    journal = journal or Journal()
+    kept = set(server.id for server in keep)
+
+    try:
+        leftover = [server for server in nova.servers.list(
+                        search_opts={'name': '^{}-'.format(re.escape(batch))})
+                    if server.id not in kept]
+    except novaclient.exceptions.ClientException as e:
+        say(tag, 'WARNING could not list the servers of {}: {}'.format(batch, e))
+        return
+
+    deleted = set()
+    for server in leftover:
+        say(tag, '-> Deleting {} of the failed batch {}'.format(server.name, batch))
+        try:
+            server.delete()
+        except novaclient.exceptions.NotFound:
+            pass
+        except novaclient.exceptions.ClientException as e:
+            say(tag, 'WARNING could not delete {} ({}): {}'.format(server.name, server.id, e))
+            continue
+        deleted.add(server.id)
+
+    journal.forget([name for name in names
+                    if (journal.get(name, 'created') or dict()).get('id') in deleted])
+
+
+def boot(nodes, prefix='', dry_run=False,
+         waitForActiveSleep=1,
+         waitForActiveTimeout=60,
+         parallel=1,
+         multi_create=False,
+         journal=None,
+         api_rate=None,
+         api_retries=5,
+         client=None,
+         events=None,
+         **kws):
+    """[Node] -> ... -> generator of Node
+
+    Boot `nodes`, yielding each one as it finishes booting, except
+    those skipped because of a broken server (see `boot_node`).  With
+    `parallel` > 1 up to that many nodes are booted concurrently and
+    are yielded in order of completion rather than in the order given.
+
+    With `multi_create` the nodes that do not exist yet are created
+    with one request per homogeneous batch (see `create_batch`) before
+    the rest of the boot pipeline runs.
+
+    Progress is recorded in `journal` and phases it already holds are
+    skipped (see `boot_node`).
+
+    All the API calls share one connection pool sized to `parallel`,
+    are retried up to `api_retries` times and, with `api_rate`, are
+    limited to that many per second.  They are made with `client`
+    instead, if it is given.
+
+    The duration of each phase of each node and the API requests are
+    recorded in `events` (see `vcl.events.EventLog`).
+
+    A `dry_run` only shows the names the nodes would get, without
+    making any API call.
+    """
+
+    import collections
+
+    if dry_run:
+        for node in nodes:
+            yield boot_node(None, node, prefix=prefix, dry_run=True)
+        return
+
+    events = events or EventLog()
+    nova = client or get_client(pool_size=max(1, parallel),
+                                retries=api_retries, rate=api_rate,
+                                events=events)
+    catalog = Catalog(nova)
+    poller = StatusPoller(nova, sleep_time=waitForActiveSleep)
+    floating_ips = FloatingIPPool(nova, retries=api_retries)
+    journal = journal or Journal()
+    created = dict()
+
+    # one listing for all the nodes, to find those that exist already
+    nodes = list(nodes)
+    servers = ServerIndex(nova, prefix=prefix)
+
+    def exists(node):
+        name = prefix + node.hostname
+        created = journal.get(name, 'created')
+        return name in servers or \
+            (created is not None and servers.by_id(created['id']) is not None)
+
+    pending = [node for node in nodes if not exists(node)]
+
+    wanted = collections.Counter(node.floating_ip_pool for node in pending
+                                 if node.create_floating_ip)
+    for pool, count in wanted.iteritems():
+        allocated = floating_ips.reserve(count, pool)
+        if allocated:
+            say(None, '-> Allocated {} floating ips from pool {}'.format(allocated, pool))
+
+    if multi_create:
+        for batch in homogeneous_batches(pending):
+            if len(batch) > 1:
+                created.update(create_batch(nova, batch, prefix=prefix,
+                                            catalog=catalog,
+                                            journal=journal,
+                                            events=events,
+                                            poller=poller))
+
+    if parallel <= 1:
+        for node in nodes:
+            node = boot_node(nova, node, prefix=prefix,
+                             waitForActiveSleep=waitForActiveSleep,
+                             waitForActiveTimeout=waitForActiveTimeout,
+                             catalog=catalog,
+                             poller=poller,
+                             created=created,
+                             floating_ips=floating_ips,
+                             servers=servers,
+                             journal=journal,
+                             events=events,
+                             retries=api_retries)
+            if node is not None:
+                yield node
+        return
+
+    def work(node):
+        return boot_node(nova, node, prefix=prefix,
+                         waitForActiveSleep=waitForActiveSleep,
+                         waitForActiveTimeout=waitForActiveTimeout,
+                         tag=prefix + node.hostname,
+                         catalog=catalog,
+                         poller=poller,
+                         created=created,
+                         floating_ips=floating_ips,
+                         servers=servers,
+                         journal=journal,
+                         events=events,
+                         retries=api_retries)
+
+    for node in concurrently(work, nodes, parallel):
+        if node is not None:
+            yield node
+
+
+def wait_until_deleted(nova, servers, prefix='', sleep_time=1, max_time=300):
+    """Client -> [Server] -> str -> ... -> ()
+
+    Wait until none of `servers` is listed any more, with one listing
+    of the servers named `prefix`* per `sleep_time` seconds.  Raises
+    RuntimeError if any of them is in ERROR without being deleted any
+    more, or is still there after `max_time` seconds.
+    """
+
+    import re
+    import time
+
+    search_opts = {'name': '^' + re.escape(prefix)} if prefix else None
+    remaining = dict((server.id, server.name) for server in servers)
+    deadline = time.time() + max_time
+
+    while remaining:
+        listed = dict((server.id, server)
+                      for server in nova.servers.list(search_opts=search_opts)
+                      if server.status != 'DELETED')
+        for ident in remaining.keys():
+            if ident not in listed:
+                del remaining[ident]
+
+        # nova keeps listing an errored server as ERROR while deleting
+        # it: only a server no longer being deleted failed to be
+        errored = sorted(remaining[ident] for ident in remaining
+                         if listed[ident].status == 'ERROR' and
+                         listed[ident]._info.get('OS-EXT-STS:task_state',
+                                                 'deleting') != 'deleting')
+        if errored:
+            raise RuntimeError('Failed to delete {}'.format(', '.join(errored)))
+
+        if not remaining:
+            break
+
+        if time.time() > deadline:
+            raise RuntimeError('Timed out waiting for {} to be deleted'
+                               .format(', '.join(sorted(remaining.values()))))
+
+        say(None, '-> Waiting for {} servers to be deleted'.format(len(remaining)))
+        time.sleep(sleep_time)
+
+
+def destroy(names, prefix='', dry_run=False, parallel=10, journal=None,
+            release_floating_ips=True,
+            waitForDeletedSleep=1,
+            waitForDeletedTimeout=300,
+            confirm=None,
+            api_rate=None,
+            api_retries=5,
+            client=None):
+    """[str] -> ... -> [str]
+
+    Delete the servers named `prefix` + each of `names` and return the
+    names of the deleted servers.
+
+    The servers are found with a single listing.  If `confirm` is given
+    it is called with the servers and nothing is deleted unless it
+    returns True.  Up to `parallel` servers are deleted concurrently,
+    then their disappearance is checked with one listing per
+    `waitForDeletedSleep` seconds.  Afterwards the floating ips that
+    were associated with them, and those that `journal` records as
+    allocated for them by `boot` and that are not associated with
+    another server, are released unless `release_floating_ips` is
+    False.  The servers are removed from the
+    journal.
+
+    The API calls are made with `client` if it is given.
+    """
+
+    nova = client or get_client(pool_size=max(1, parallel),
+                                retries=api_retries, rate=api_rate)
+    journal = journal or Journal()
+    index = ServerIndex(nova, prefix=prefix)
+
+    servers = []
+    for name in names:
+        found = index.all(prefix + name)
+        if not found:
+            say(prefix + name, '-> Not found')
+        servers.extend(found)
+
+    if not servers:
+        return []
+
+    if confirm is not None and not confirm(servers):
+        return []
+
+    deleted = [server.name for server in servers]
+
+    # list the floating ips before deleting the servers disassociates
+    # them, rather than relying on the journal alone: it may have been
+    # lost, or not know about addresses associated by hand
+    addresses = []
+    by_address = dict()
+    if release_floating_ips:
+        ids = set(server.id for server in servers)
+        for fip in nova.floating_ips.list():
+            by_address[fip.ip] = fip
+            if fip.instance_id in ids:
+                addresses.append(fip.ip)
+
+        # the journal may be stale: leave addresses that have been
+        # associated with another server since alone
+        for name in set(deleted):
+            entry = journal.get(name, 'floating_ip')
+            if entry is None or not entry.get('allocated') or \
+                    entry['ip'] not in by_address or entry['ip'] in addresses:
+                continue
+            instance = by_address[entry['ip']].instance_id
+            if instance is None or instance in ids:
+                addresses.append(entry['ip'])
+
+    if dry_run:
+        for server in servers:
+            say(server.name, '-> Would delete')
+        for address in addresses:
+            say(None, '-> Would release floating ip {}'.format(address))
+        return deleted
+
+    def delete(server):
+        try:
+            server.delete()
+        except novaclient.exceptions.NotFound:
+            pass
+        say(server.name, '-> Deleting')
+        return server
+
+    for _ in concurrently(delete, servers, parallel):
+        pass
+
+    wait_until_deleted(nova, servers, prefix=prefix,
+                       sleep_time=waitForDeletedSleep,
+                       max_time=waitForDeletedTimeout)
+
+    def release(address):
+        try:
+            nova.floating_ips.delete(by_address[address])
+        except novaclient.exceptions.NotFound:
+            return
+        say(None, '-> Released floating ip {}'.format(address))
+
+    for _ in concurrently(release, addresses, parallel):
+        pass
+
+    journal.forget(deleted)
+    return deleted
+
+
+def status(nodes, machines=None, prefix=''):
+    """[Node] -> {str: Node} or None -> str -> [dict]
+
+    Compare the specified `nodes`, the booted `machines` (hostname ->
+    node, eg a `MachinesIndex`) and the servers named `prefix`*, with
+    one listing of the servers and one of the flavors.
+
+    Returns one row per node or server with its `hostname`, server
+    `name`, server `status` (None if there is no server) and the
+    `problems` found:
+
+      - 'missing': no server for a specified node
+      - 'extra': a server that is not specified, among those with the
+        prefix or those in `machines`
+      - 'duplicate': several servers have the node's name
+      - 'error': the server is in ERROR
+      - 'flavor': the server has another flavor than specified
+      - 'ip', 'floating_ip': the server's address differs from the one
+        in `machines`
+    """
+
+    import collections
+
+    nova = get_client()
+    servers = ServerIndex(nova, prefix=prefix)
+    flavors = dict((flavor.id, flavor.name) for flavor in nova.flavors.list())
+
+    def row(hostname, server):
+        r = collections.OrderedDict()
+        r['hostname'] = hostname
+        r['name'] = prefix + hostname
+        r['status'] = server.status if server is not None else None
+        r['problems'] = []
+        return r
+
+    def check_address(r, kind, expected, actual):
+        if expected != actual:
+            r['problems'].append(kind)
+            r[kind] = dict(expected=expected, actual=actual)
+
+    rows = []
+    specified = set()
+
+    for node in nodes:
+        specified.add(node.hostname)
+        found = servers.all(prefix + node.hostname)
+        server = found[0] if found else None
+        r = row(node.hostname, server)
+        rows.append(r)
+
+        if server is None:
+            r['problems'].append('missing')
+            continue
+        if len(found) > 1:
+            r['problems'].append('duplicate')
+        if server.status == 'ERROR':
+            r['problems'].append('error')
+
+        flavor = flavors.get(server.flavor['id'], server.flavor['id'])
+        if flavor != node.flavor:
+            r['problems'].append('flavor')
+            r['flavor'] = dict(expected=node.flavor, actual=flavor)
+
+        booted = machines.get(node.hostname) if machines is not None else None
+        if booted is not None:
+            fixed = server_addresses(server, node.network, 'fixed')
+            floating = server_addresses(server, node.network, 'floating')
+            check_address(r, 'ip', booted.ip, fixed[0] if fixed else None)
+            check_address(r, 'floating_ip', booted.get('floating_ip'),
+                          floating[0] if floating else None)
+
+    candidates = set()
+    if prefix:
+        candidates.update(server.name[len(prefix):] for server in servers)
+    if machines is not None:
+        candidates.update(machines.hostnames())
+
+    for hostname in sorted(candidates - specified):
+        for server in servers.all(prefix + hostname):
+            r = row(hostname, server)
+            r['problems'].append('extra')
+            rows.append(r)
+
+    return rows
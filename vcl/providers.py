@@ -0,0 +1,28 @@
+"""
+The VM providers the subcommands can use
+"""
+
+import importlib
+
+
+# providers are imported on demand, as their client libraries are slow
+# to import
+PROVIDERS = dict(
+    openstack = 'vcl.openstack',
+    # libvirt = 'vcl.boot.libvirt'
+)
+
+DEFAULT_PROVIDER = 'openstack'
+
+
+def load_provider(name=None):
+    """str or None -> module
+
+    The module implementing provider `name` (default: `DEFAULT_PROVIDER`)
+    """
+
+    name = name or DEFAULT_PROVIDER
+    if name not in PROVIDERS:
+        raise ValueError, 'Unknown provider {!r}, expected one of {}'\
+            .format(name, ', '.join(sorted(PROVIDERS)))
+    return importlib.import_module(PROVIDERS[name])
@@ -0,0 +1,44 @@
+"""
+Client-side rate limiting
+"""
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket
+
+    Tokens are added at `rate` per second, up to `burst` (default: one
+    second worth of tokens).  `acquire` blocks until a token is
+    available, so all the threads sharing a bucket together make at
+    most `rate` calls per second after the initial burst.
+
+    >>> bucket = TokenBucket(10)
+    >>> bucket.acquire()
+    """
+
+    def __init__(self, rate, burst=None):
+        assert rate > 0, rate
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self._tokens = self.burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = max(0, now - self._last)
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._last = now
+
+    def acquire(self, tokens=1):
+        """Take `tokens`, waiting until they are available"""
+
+        while True:
+            with self._lock:
+                self._refill(time.time())
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
@@ -0,0 +1,178 @@
+"""
+Wait for booted machines to accept ssh connections
+"""
+
+import collections
+import errno
+import select
+import socket
+import time
+
+
+def node_address(node):
+    """Node -> str"""
+    return getattr(node, 'floating_ip', None) or node.ip
+
+
+class _Probe(object):
+    """The state of probing a single node"""
+
+    __slots__ = ('hostname', 'address', 'sock', 'reading', 'expires',
+                 'next_try', 'banner')
+
+    def __init__(self, hostname, address):
+        self.hostname = hostname
+        self.address = address
+        self.sock = None
+        self.reading = False
+        self.expires = None
+        self.next_try = 0
+        self.banner = ''
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+        self.reading = False
+        self.banner = ''
+
+
+class _Poller(object):
+    """select.poll, or select.select where poll is not available"""
+
+    def __init__(self):
+        self._poll = select.poll() if hasattr(select, 'poll') else None
+        self._fds = dict()
+
+    def register(self, fd, read):
+        self._fds[fd] = read
+        if self._poll is not None:
+            mask = select.POLLIN if read else select.POLLOUT
+            self._poll.register(fd, mask | select.POLLERR | select.POLLHUP)
+
+    def unregister(self, fd):
+        del self._fds[fd]
+        if self._poll is not None:
+            self._poll.unregister(fd)
+
+    def poll(self, timeout):
+        """float -> [fd]"""
+        if self._poll is not None:
+            return [fd for fd, _ in self._poll.poll(timeout * 1000)]
+        if not self._fds:
+            time.sleep(timeout)
+            return []
+        rs = [fd for fd, read in self._fds.iteritems() if read]
+        ws = [fd for fd, read in self._fds.iteritems() if not read]
+        r, w, x = select.select(rs, ws, ws, timeout)
+        return list(set(r + w + x))
+
+
+def wait_for_ssh(nodes, timeout=300, port=22, banner=False, interval=1,
+                 attempt_timeout=5, max_open=256):
+    """[Node] -> int -> int -> bool -> ... -> OrderedDict str float
+
+    Probe `port` on the floating (or else fixed) ip of all `nodes`
+    concurrently, with non-blocking sockets, until each accepts a
+    connection.  With `banner` the node must also send the SSH
+    identification string.  Failed attempts are retried every
+    `interval` seconds, attempts taking longer than `attempt_timeout`
+    are abandoned, and at most `max_open` connections are open at a
+    time.
+
+    Returns the seconds each node took to become reachable, in the
+    order they did.  Raises RuntimeError if some nodes are still not
+    reachable after `timeout` seconds.
+    """
+
+    start = time.time()
+    deadline = start + timeout
+
+    idle = collections.deque(_Probe(node.hostname, node_address(node))
+                             for node in nodes)
+    active = dict()                              # fd -> _Probe
+    poller = _Poller()
+    ready = collections.OrderedDict()
+
+    def retry(probe, now):
+        poller.unregister(probe.sock.fileno())
+        del active[probe.sock.fileno()]
+        probe.close()
+        probe.next_try = now + interval
+        idle.append(probe)
+
+    def done(probe, now):
+        poller.unregister(probe.sock.fileno())
+        del active[probe.sock.fileno()]
+        probe.close()
+        ready[probe.hostname] = now - start
+
+    while idle or active:
+
+        now = time.time()
+        if now > deadline:
+            for probe in active.values():
+                probe.close()
+            missing = sorted([p.hostname for p in idle] +
+                             [p.hostname for p in active.values()])
+            raise RuntimeError('Timed out waiting for ssh on {}'
+                               .format(', '.join(missing)))
+
+        # start the attempts that are due
+        for _ in xrange(len(idle)):
+            if len(active) >= max_open:
+                break
+            probe = idle.popleft()
+            if probe.next_try > now:
+                idle.append(probe)
+                continue
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(0)
+            err = sock.connect_ex((probe.address, port))
+            probe.sock = sock
+            probe.expires = now + attempt_timeout
+            active[sock.fileno()] = probe
+            poller.register(sock.fileno(), read=False)
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                retry(probe, now)
+
+        if not active:
+            time.sleep(max(0, min(p.next_try for p in idle) - now))
+            continue
+
+        for fd in poller.poll(0.5):
+            probe = active[fd]
+            now = time.time()
+
+            if not probe.reading:
+                err = probe.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err != 0:
+                    retry(probe, now)
+                elif not banner:
+                    done(probe, now)
+                else:
+                    probe.reading = True
+                    poller.unregister(fd)
+                    poller.register(fd, read=True)
+                continue
+
+            try:
+                data = probe.sock.recv(256)
+            except socket.error:
+                data = ''
+            if not data:
+                # closed before sending the banner: sshd is not up yet
+                retry(probe, now)
+                continue
+            probe.banner += data
+            if probe.banner.startswith('SSH-'):
+                done(probe, now)
+            elif len(probe.banner) >= 4:
+                retry(probe, now)
+
+        now = time.time()
+        for probe in active.values():
+            if probe.expires < now:
+                retry(probe, now)
+
+    return ready
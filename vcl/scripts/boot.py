@@ -4,32 +4,29 @@ Boot virtual machines
 
 from __future__ import absolute_import
 
-from vcl.specification import update_spec, mk_nodes, load_spec, inventory_format
-from vcl import openstack
-import yaml
-# from vcl.boot import libvirt
-
-
-__PROVIDERS = dict(
-    openstack = openstack,
-    # libvirt = libvirt
-)
-
 
 def add_parser(p):
 
     from .defaults import \
           spec_filename \
         , inventory_filename \
-        , machines_filename
+        , inventory_index_filename \
+        , machines_filename \
+        , journal_filename
 
     p.add_argument('--provider', '-p', metavar='STR', default=None,
                    help='The VM provider')
     p.add_argument('--specfile', '-s', metavar='FILE',
                    default=spec_filename, help='The cluster specification file')
+    p.add_argument('--no-spec-cache', dest='spec_cache', default=True,
+                   action='store_false',
+                   help='Always evaluate the specification file instead of using a cached copy')
     p.add_argument('--inventory', '-i', metavar='FILE',
                    default=inventory_filename,
                    help='The inventory file to write')
+    p.add_argument('--inventory-index', '-I', metavar='FILE',
+                   default=inventory_index_filename,
+                   help='The inventory index to write, for "vcl inventory"')
     p.add_argument('--dry-run', '-n', default=False, action='store_true',
                    help='Don\'t actually do anything')
     p.add_argument('--machines', '-m', metavar='FILE', default=machines_filename,
@@ -40,35 +37,91 @@ def add_parser(p):
                    help='Number of seconds to wait for a node to become ACTIVE before giving up')
     p.add_argument('--wait-until-active-poll', '-A', default=1, type=int,
                    help='Number of seconds to wait between polling a new instance to see if it is ACTIVE')
+    p.add_argument('--parallel', '-j', metavar='N', default=1, type=int,
+                   help='Number of nodes to boot concurrently')
+    p.add_argument('--multi-create', '-M', default=False, action='store_true',
+                   help='Create identical nodes with a single request per group.  Their servers are renamed after the nodes, but the guests keep the temporary vcl-XXXXXXXX-N hostname')
+    p.add_argument('--api-rate', metavar='N', default=None, type=float,
+                   help='Make at most N API requests per second')
+    p.add_argument('--api-retries', metavar='N', default=5, type=int,
+                   help='Number of times to retry API requests failing with transient errors')
+    p.add_argument('--journal', '-J', metavar='FILE', default=journal_filename,
+                   help='The file to record the progress of each node in')
+    p.add_argument('--resume', '-r', default=False, action='store_true',
+                   help='Resume an interrupted boot from the journal')
+    p.add_argument('--events', '-E', metavar='FILE', default=None,
+                   help='Write the timing of each boot phase and API request to FILE as JSON lines')
+    p.add_argument('--wait-for-ssh', '-w', default=False, action='store_true',
+                   help='Only return once every node accepts ssh connections')
+    p.add_argument('--ssh-timeout', metavar='SEC', default=300, type=int,
+                   help='Number of seconds to wait for the nodes to accept ssh connections')
+    p.add_argument('--ssh-banner', default=False, action='store_true',
+                   help='Also wait for the ssh server to send its banner')
 
 
 def main(opts):
-    global __PROVIDERS
-
-    spec = load_spec(opts.specfile)
-    nodes = mk_nodes(spec, provider=opts.provider)
+    from vcl.specification import update_spec, mk_nodes, load_spec, inventory_format, inventory_index
+    import json
+    from vcl.machines import MachinesWriter
+    from vcl.journal import Journal
+    from vcl.events import EventLog
+    from vcl.providers import load_provider
+
+    spec = load_spec(opts.specfile, cache=opts.spec_cache)
+    nodes = mk_nodes(spec, provider=opts.provider, compact=True)
     update_spec(spec, nodes)
 
     provider = opts.provider or spec.defaults.provider
 
-    module = __PROVIDERS[provider]
+    if opts.dry_run:
+        journal = Journal()
+    else:
+        journal = Journal(opts.journal, resume=opts.resume)
+
+    events = EventLog(opts.events)
+
+    module = load_provider(provider)
     machines = module.boot(nodes, prefix=opts.prefix, dry_run=opts.dry_run,
                            waitForActiveSleep=opts.wait_until_active_poll,
                            waitForActiveTimeout=opts.wait_until_active_timeout,
+                           parallel=opts.parallel,
+                           multi_create=opts.multi_create,
+                           journal=journal,
+                           api_rate=opts.api_rate,
+                           api_retries=opts.api_retries,
+                           events=events,
                            )
 
-    with open(opts.machines, 'w') as fd: fd.write('')
-
-    for m in machines:
-        with open(opts.machines, 'a') as fd:
-            o = {m.hostname: m.to_simple_types()}
-            s = yaml.dump(o, default_flow_style=False)
-            fd.write(s)
+    # boot yields the nodes as they finish booting
+    booted = []
+    with journal, MachinesWriter(opts.machines) as writer:
+        for m in machines:
+            writer.write(m)
+            booted.append(m)
 
     with open(opts.inventory, 'w') as fd:
         i = inventory_format(spec)
         fd.write(i)
 
+    with open(opts.inventory_index, 'w') as fd:
+        json.dump(inventory_index(spec), fd, indent=1)
+        fd.write('\n')
+
+    if opts.wait_for_ssh and not opts.dry_run:
+        from vcl.readiness import wait_for_ssh
+
+        print 'Waiting for ssh on', len(booted), 'nodes'
+        latencies = wait_for_ssh(booted, timeout=opts.ssh_timeout,
+                                 banner=opts.ssh_banner)
+        for hostname, seconds in latencies.iteritems():
+            print '[{}] ssh ready after {:.1f}s'.format(hostname, seconds)
+            events.record(opts.prefix + hostname, 'ssh', seconds)
+
+    events.close()
+    if events.durations:
+        print
+        print events.summary()
+
     # TODO: write_inventory(opts.inventory, mod.inventory, nodes)
 
 
@@ -1,4 +1,6 @@
 
 spec_filename = '.cluster.py'
 inventory_filename = 'inventory.txt'
+inventory_index_filename = '.inventory.json'
 machines_filename = '.machines.yml'
+journal_filename = '.boot.journal'
@@ -0,0 +1,91 @@
+"""
+Delete the virtual machines of a cluster
+"""
+
+from __future__ import absolute_import
+
+
+def add_parser(p):
+
+    from .defaults import \
+          spec_filename \
+        , machines_filename \
+        , journal_filename
+
+    p.add_argument('--provider', '-p', metavar='STR', default=None,
+                   help='The VM provider (default: from the specification, or openstack)')
+    p.add_argument('--machines', '-m', metavar='FILE', default=machines_filename,
+                   help='The machines file listing the nodes to delete')
+    p.add_argument('--from-spec', '-S', default=False, action='store_true',
+                   help='Delete the nodes of the specification instead of the machines file')
+    p.add_argument('--specfile', '-s', metavar='FILE',
+                   default=spec_filename, help='The cluster specification file')
+    p.add_argument('--no-spec-cache', dest='spec_cache', default=True,
+                   action='store_false',
+                   help='Always evaluate the specification file instead of using a cached copy')
+    p.add_argument('--prefix', '-P', metavar='STR', default='',
+                   help='The prefix the nodes were booted with')
+    p.add_argument('--dry-run', '-n', default=False, action='store_true',
+                   help='Only show what would be deleted')
+    p.add_argument('--yes', '-y', default=False, action='store_true',
+                   help='Do not ask for confirmation')
+    p.add_argument('--parallel', '-j', metavar='N', default=10, type=int,
+                   help='Number of delete requests to make concurrently')
+    p.add_argument('--journal', '-J', metavar='FILE', default=journal_filename,
+                   help='The boot journal, recording the floating ips allocated by "vcl boot"')
+    p.add_argument('--keep-floating-ips', dest='release_floating_ips',
+                   default=True, action='store_false',
+                   help='Do not release the floating ips of the deleted servers')
+    p.add_argument('--wait-until-deleted-timeout', '-a', default=300, type=int,
+                   help='Number of seconds to wait for the nodes to disappear')
+    p.add_argument('--wait-until-deleted-poll', '-A', default=1, type=int,
+                   help='Number of seconds to wait between listing the remaining nodes')
+
+
+def confirm(servers):
+    """[Server] -> bool"""
+
+    for server in sorted(servers, key=lambda server: server.name):
+        print '  {} ({})'.format(server.name, server.id)
+    answer = raw_input('Delete these {} servers? [y/N] '.format(len(servers)))
+    return answer.strip().lower() in ('y', 'yes')
+
+
+def main(opts):
+    import os
+    from vcl.journal import Journal
+    from vcl.providers import load_provider
+
+    provider = opts.provider
+
+    if opts.from_spec:
+        from vcl.specification import load_spec, mk_nodes
+        spec = load_spec(opts.specfile, cache=opts.spec_cache)
+        provider = provider or spec.defaults.provider
+        names = [node.hostname
+                 for node in mk_nodes(spec, provider=provider, compact=True)]
+    else:
+        from vcl.machines import MachinesIndex
+        with MachinesIndex(opts.machines) as machines:
+            names = list(machines.hostnames())
+
+    if os.path.exists(opts.journal):
+        journal = Journal(opts.journal, resume=True)
+    else:
+        journal = Journal()
+
+    module = load_provider(provider)
+
+    with journal:
+        deleted = module.destroy(
+            names, prefix=opts.prefix, dry_run=opts.dry_run,
+            parallel=opts.parallel,
+            journal=journal,
+            release_floating_ips=opts.release_floating_ips,
+            waitForDeletedSleep=opts.wait_until_deleted_poll,
+            waitForDeletedTimeout=opts.wait_until_deleted_timeout,
+            confirm=None if opts.yes or opts.dry_run else confirm,
+        )
+
+    if not opts.dry_run:
+        print 'Deleted', len(deleted), 'servers'
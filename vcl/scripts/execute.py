@@ -0,0 +1,205 @@
+"""
+Run a command on many machines concurrently
+"""
+
+from __future__ import absolute_import
+
+import argparse
+
+
+def add_parser(p):
+
+    from .defaults import machines_filename, inventory_index_filename
+
+    p.add_argument('--machines', '-m', metavar='FILE',
+                   default=machines_filename,
+                   help='Path to the machines file')
+    p.add_argument('--index', '-x', metavar='FILE',
+                   default=inventory_index_filename,
+                   help='The inventory index to resolve group names with')
+    p.add_argument('--forks', '-f', metavar='N', default=20, type=int,
+                   help='Number of hosts to run the command on concurrently')
+    p.add_argument('--timeout', '-t', metavar='SEC', default=10, type=int,
+                   help='Seconds to wait for an ssh connection to be established')
+    p.add_argument('--control-persist', metavar='SEC', default=60, type=int,
+                   help='Seconds to keep idle ssh master connections open (0 to disable them)')
+    p.add_argument('target', metavar='TARGET',
+                   help='Comma separated inventory group names and/or hostname patterns (eg "datanodes,master*")')
+    p.add_argument('command', metavar='CMD', nargs=argparse.REMAINDER,
+                   help='The command to run, after "--"')
+
+
+def select_hosts(target, hostnames, groups=None):
+    """str -> [str] -> {str: [str]} or None -> [str]
+
+    Resolve the comma separated `target` to hostnames.  Each element is
+    either the name of one of the inventory `groups` or a shell-style
+    pattern matched against `hostnames`.  Hosts are returned once, in
+    the order they are first selected.
+    """
+
+    from fnmatch import fnmatchcase
+
+    groups = groups or dict()
+    selected = []
+    seen = set()
+
+    for pattern in target.split(','):
+        if not pattern:
+            continue
+        if pattern in groups:
+            matches = groups[pattern]
+        else:
+            matches = [h for h in hostnames if fnmatchcase(h, pattern)]
+            if not matches:
+                raise ValueError('No group or host matches {!r}'.format(pattern))
+        for hostname in matches:
+            if hostname not in seen:
+                seen.add(hostname)
+                selected.append(hostname)
+
+    return selected
+
+
+def load_groups(path):
+    """str -> {str: [str]}
+
+    The inventory groups of the inventory index at `path`, if it exists
+    """
+
+    import json
+    import os
+
+    if not os.path.exists(path):
+        return dict()
+
+    with open(path) as fd:
+        index = json.load(fd)
+
+    return dict((name, group['hosts'])
+                for name, group in index.iteritems()
+                if name != '_meta' and 'hosts' in group)
+
+
+def control_options(persist, timeout):
+    """int -> int -> [str]
+
+    ssh options to share one master connection per host between runs
+    """
+
+    options = ['-o', 'BatchMode=yes',
+               '-o', 'ConnectTimeout={}'.format(timeout)]
+    if persist > 0:
+        options += ['-o', 'ControlMaster=auto',
+                    '-o', 'ControlPath=~/.ssh/vcl-%C',
+                    '-o', 'ControlPersist={}'.format(persist)]
+    return options
+
+
+class Output(object):
+    """Line-atomic output of host prefixed lines from many threads"""
+
+    def __init__(self, stream, width=0):
+        import threading
+        self.stream = stream
+        self.width = width
+        self._lock = threading.Lock()
+
+    def line(self, hostname, line):
+        with self._lock:
+            self.stream.write('{} | {}\n'.format(hostname.ljust(self.width),
+                                                 line.rstrip('\n')))
+            self.stream.flush()
+
+
+def run(hostname, cmd, output):
+    """str -> [str] -> Output -> int
+
+    Run `cmd`, streaming its output prefixed with `hostname`
+    """
+
+    import os
+    import subprocess
+
+    with open(os.devnull) as devnull:
+        proc = subprocess.Popen(cmd, stdin=devnull, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        for line in iter(proc.stdout.readline, ''):
+            output.line(hostname, line)
+        return proc.wait()
+
+
+def execute(nodes, command, forks=20, options=(), output=None):
+    """[Node] -> [str] -> int -> [str] -> Output -> [(str, int)]
+
+    Run `command` on `nodes` over ssh, `forks` at a time.  Returns the
+    exit code of each host, in the order they finished.
+    """
+
+    from multiprocessing.pool import ThreadPool
+    import multiprocessing
+    import sys
+
+    from .ssh import ssh_command
+
+    if output is None:
+        width = max([len(node.hostname) for node in nodes] or [0])
+        output = Output(sys.stdout, width=width)
+
+    def work(node):
+        cmd = ssh_command(node, command, options=options)
+        return node.hostname, run(node.hostname, cmd, output)
+
+    pool = ThreadPool(max(1, min(forks, len(nodes))))
+    results = []
+    try:
+        it = pool.imap_unordered(work, nodes)
+        while True:
+            try:
+                # a timeout keeps the main thread responsive to ^C
+                results.append(it.next(0.5))
+            except multiprocessing.TimeoutError:
+                continue
+            except StopIteration:
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return results
+
+
+def main(opts):
+
+    import sys
+    import time
+
+    from vcl.machines import MachinesIndex
+
+    if not opts.command:
+        raise ValueError('No command given')
+
+    groups = load_groups(opts.index)
+
+    with MachinesIndex(opts.machines) as machines:
+        hostnames = select_hosts(opts.target, list(machines.hostnames()),
+                                 groups=groups)
+        missing = [h for h in hostnames if h not in machines]
+        if missing:
+            raise ValueError('Unknown hosts: {}'.format(', '.join(missing)))
+        nodes = [machines[h] for h in hostnames]
+
+    options = control_options(opts.control_persist, opts.timeout)
+
+    start = time.time()
+    results = execute(nodes, opts.command, forks=opts.forks, options=options)
+    elapsed = time.time() - start
+
+    failed = sorted((h, rc) for h, rc in results if rc != 0)
+    for hostname, rc in failed:
+        print >>sys.stderr, '{}: exit code {}'.format(hostname, rc)
+    print >>sys.stderr, '{} hosts, {} failed, {:.1f}s'.format(
+        len(results), len(failed), elapsed)
+
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,66 @@
+"""
+Ansible dynamic inventory of the booted cluster
+"""
+
+from __future__ import absolute_import
+
+import json
+import os
+import sys
+
+
+def add_parser(p):
+
+    from .defaults import inventory_index_filename
+
+    p.add_argument('--index', '-x', metavar='FILE',
+                   default=os.getenv('VCL_INVENTORY', inventory_index_filename),
+                   help='The inventory index written by "vcl boot" (or $VCL_INVENTORY)')
+    what = p.add_mutually_exclusive_group(required=True)
+    what.add_argument('--list', action='store_true',
+                      help='Print all groups and host variables')
+    what.add_argument('--host', metavar='HOST',
+                      help='Print the variables of a single host')
+
+
+def host_vars(index, hostname):
+    """dict -> str -> dict
+
+    The variables of `hostname`, including those set on its groups
+    """
+
+    meta = index['_meta']
+
+    if 'hostgroups' in meta:
+        groups = meta['hostgroups'].get(hostname, ())
+    else:
+        # written by an older vcl
+        groups = [name for name, group in index.iteritems()
+                  if name not in ('_meta', 'all')
+                  and hostname in group.get('hosts', ())]
+
+    variables = dict(index.get('all', dict()).get('vars', dict()))
+    for name in groups:
+        variables.update(index[name].get('vars', dict()))
+    variables.update(meta['hostvars'].get(hostname, dict()))
+    return variables
+
+
+def main(opts):
+
+    if opts.list:
+        # the index is already in the format Ansible expects
+        with open(opts.index) as fd:
+            sys.stdout.write(fd.read())
+        return
+
+    with open(opts.index) as fd:
+        index = json.load(fd)
+    json.dump(host_vars(index, opts.host), sys.stdout)
+    sys.stdout.write('\n')
+
+
+def script():
+    """Entry point to use as an Ansible inventory script (`ansible -i`)"""
+    from vcl.__main__ import main as vcl_main
+    vcl_main(['inventory'] + sys.argv[1:])
@@ -4,7 +4,7 @@ List running VMs
 
 from __future__ import absolute_import
 
-from vcl.specification import load_machines
+from vcl.machines import MachinesIndex
 
 
 def add_parser(p):
@@ -19,7 +19,6 @@ def add_parser(p):
 
 def main(opts):
 
-    machines = load_machines(opts.machines)
-
-    for hostname in machines:
-        print hostname
+    with MachinesIndex(opts.machines) as machines:
+        for hostname in machines.hostnames():
+            print hostname
@@ -4,7 +4,7 @@ Ssh into a machines
 
 from __future__ import absolute_import
 
-from vcl.specification import load_machines
+from vcl.machines import MachinesIndex
 
 def add_parser(p):
 
@@ -18,28 +18,42 @@ def add_parser(p):
 
 
 
+def address(node):
+    """Node -> str
+
+    The address to reach `node` at: its floating ip if it has one
+    """
+    if hasattr(node, 'floating_ip') and node.floating_ip is not None:
+        return node.floating_ip
+    else:
+        return node.ip
+
+
+def ssh_command(node, args, options=()):
+    """Node -> [str] -> [str] -> [str]
+
+    The ssh command line to run `args` on `node`, with additional ssh
+    `options` (eg ['-o', 'BatchMode=yes'])
+    """
+
+    return ['ssh',
+            '-o', 'UserKnownHostsFile=/dev/null',
+            '-o', 'StrictHostKeyChecking=no',
+    ] + list(options) + [address(node)] + list(args)
+
+
 def ssh(hostname, machines, args):
 
     from subprocess import call
     import sys
     from pipes import quote
 
-    node = machines[hostname]
-    if hasattr(node, 'floating_ip') and node.floating_ip is not None:
-        ip = node.floating_ip
-    else:
-        ip = node.ip
-
-    cmd = ['ssh',
-           '-o', 'UserKnownHostsFile=/dev/null',
-           '-o', 'StrictHostKeyChecking=no',
-           ip
-    ] + args
+    cmd = ssh_command(machines[hostname], args)
 
     print ' '.join(map(quote, cmd))
     call(cmd, stderr=sys.stderr, stdout=sys.stdout)
 
 
 def main(opts):
-    machines = load_machines(opts.machines)
-    ssh(opts.hostname, machines, opts.arguments)
+    with MachinesIndex(opts.machines) as machines:
+        ssh(opts.hostname, machines, opts.arguments)
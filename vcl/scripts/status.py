@@ -0,0 +1,85 @@
+"""
+Compare the specification, the machines file and the running VMs
+"""
+
+from __future__ import absolute_import
+
+
+def add_parser(p):
+
+    from .defaults import spec_filename, machines_filename
+
+    p.add_argument('--provider', '-p', metavar='STR', default=None,
+                   help='The VM provider')
+    p.add_argument('--specfile', '-s', metavar='FILE',
+                   default=spec_filename, help='The cluster specification file')
+    p.add_argument('--no-spec-cache', dest='spec_cache', default=True,
+                   action='store_false',
+                   help='Always evaluate the specification file instead of using a cached copy')
+    p.add_argument('--machines', '-m', metavar='FILE', default=machines_filename,
+                   help='The machines file written by "vcl boot"')
+    p.add_argument('--prefix', '-P', metavar='STR', default='',
+                   help='The prefix the nodes were booted with')
+    p.add_argument('--json', default=False, action='store_true',
+                   help='Print the report as JSON')
+    p.add_argument('--problems', '-q', default=False, action='store_true',
+                   help='Only show the nodes with problems')
+
+
+def format_table(rows):
+    """[dict] -> str"""
+
+    def describe(row):
+        problems = []
+        for problem in row['problems']:
+            if isinstance(row.get(problem), dict):
+                problems.append('{} {expected} -> {actual}'.format(problem, **row[problem]))
+            else:
+                problems.append(problem)
+        return ', '.join(problems) or 'ok'
+
+    table = [('HOST', 'NAME', 'STATUS', 'PROBLEMS')]
+    for row in rows:
+        table.append((row['hostname'], row['name'], row['status'] or '-',
+                      describe(row)))
+
+    widths = [max(len(str(cells[i])) for cells in table) for i in xrange(3)]
+    lines = []
+    for cells in table:
+        lines.append('  '.join([str(c).ljust(w) for c, w in zip(cells, widths)]
+                               + [cells[-1]]))
+    return '\n'.join(lines)
+
+
+def main(opts):
+    import json
+    import os
+    import sys
+
+    from vcl.specification import load_spec, mk_nodes
+    from vcl.machines import MachinesIndex
+    from vcl.providers import load_provider
+
+    spec = load_spec(opts.specfile, cache=opts.spec_cache)
+    provider = opts.provider or spec.defaults.provider
+    nodes = mk_nodes(spec, provider=provider, compact=True)
+
+    module = load_provider(provider)
+
+    if os.path.exists(opts.machines):
+        with MachinesIndex(opts.machines) as machines:
+            rows = module.status(nodes, machines=machines, prefix=opts.prefix)
+    else:
+        rows = module.status(nodes, prefix=opts.prefix)
+
+    if opts.problems:
+        rows = [row for row in rows if row['problems']]
+
+    if opts.json:
+        json.dump(rows, sys.stdout, indent=1)
+        print
+    else:
+        print format_table(rows)
+
+    if any(row['problems'] for row in rows):
+        sys.exit(1)
@@ -0,0 +1,126 @@
+"""
+Keystone session with connection pooling, retries and rate limiting
+"""
+
+import random
+import time
+
+import requests
+from keystoneclient import exceptions
+from keystoneclient.session import Session, TCPKeepAliveAdapter
+
+
+# statuses that may succeed when tried again later
+RETRY_STATUSES = frozenset([413, 429, 500, 502, 503, 504])
+
+# statuses for which the server did not act on the request, so that
+# even a POST (eg creating a server) can be sent again
+REJECTED_STATUSES = frozenset([413, 429, 503])
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+
+def backoff_delay(attempt, backoff, max_backoff):
+    """int -> float -> float -> float
+
+    A random delay before retry number `attempt` (from 0): up to
+    `backoff` * 2^attempt seconds, capped at `max_backoff`
+    """
+    return random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+
+
+def pooled_session(pool_size):
+    """int -> requests.Session
+
+    A requests session keeping up to `pool_size` connections per host
+    """
+
+    session = requests.Session()
+    for scheme in list(session.adapters):
+        session.mount(scheme, TCPKeepAliveAdapter(pool_connections=pool_size,
+                                                  pool_maxsize=pool_size))
+    return session
+
+
+def retry_after(resp):
+    """requests.Response -> float or None
+
+    The delay requested by the Retry-After header, in seconds
+    """
+
+    value = resp.headers.get('Retry-After')
+    try:
+        return max(0, float(value))
+    except (TypeError, ValueError):
+        # absent, or an HTTP date, which is not worth parsing here
+        return None
+
+
+class RetryingSession(Session):
+    """A keystoneclient Session that retries failed requests
+
+    Requests failing with a retryable status (`RETRY_STATUSES`), or
+    which could not connect, are sent again up to `retries` times,
+    waiting for a random time up to `backoff` * 2^attempt seconds
+    (capped at `max_backoff`), or as long as the server asks with
+    Retry-After.  Non idempotent requests (POST, PATCH) are only
+    retried if the server certainly did not act on them.  Those that
+    are safe to repeat anyway are retried by the caller instead (see
+    `vcl.openstack.repeatable`).
+
+    With a `rate_limiter` (eg a shared `vcl.ratelimit.TokenBucket`)
+    every request, including the retries, first acquires a token.
+    """
+
+    def __init__(self, retries=5, backoff=0.5, max_backoff=30,
+                 rate_limiter=None, **kws):
+        super(RetryingSession, self).__init__(**kws)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate_limiter = rate_limiter
+
+    def _delay(self, attempt, resp=None):
+        delay = backoff_delay(attempt, self.backoff, self.max_backoff)
+        if resp is not None:
+            delay = max(delay, retry_after(resp) or 0)
+        return delay
+
+    def _send_request(self, url, method, redirect, log, logger,
+                      connect_retries, connect_retry_delay=0.5, **kwargs):
+
+        send = super(RetryingSession, self)._send_request
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+
+        while True:
+
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+
+            try:
+                # connection failures are retried here instead
+                resp = send(url, method, redirect, log, logger, 0, **kwargs)
+            except exceptions.ConnectionRefused as e:
+                retryable = True
+                error, resp = e, None
+            except exceptions.RequestTimeout as e:
+                # the server may have received the request
+                retryable = idempotent
+                error, resp = e, None
+            else:
+                if resp.status_code not in RETRY_STATUSES:
+                    return resp
+                retryable = idempotent or resp.status_code in REJECTED_STATUSES
+                error = resp.status_code
+
+            if not retryable or attempt >= self.retries:
+                if resp is None:
+                    raise error
+                return resp
+
+            delay = self._delay(attempt, resp)
+            logger.info('%s %s failed (%s), retrying in %.1fs',
+                        method, url, error, delay)
+            time.sleep(delay)
+            attempt += 1
@@ -1,5 +1,4 @@
 
-import yaml
 import traits.api as T
 from traits.api import HasTraits, TraitHandler
 import argparse
@@ -9,6 +8,9 @@ import uuid
 
 from easydict import EasyDict
 
+from vcl.namespace import mk_namespace
+from vcl.machines import load_machines
+
 class NamespaceTraitHandler(TraitHandler):
 
     def validate(self, object, name, value):
@@ -19,17 +21,41 @@ class NamespaceTraitHandler(TraitHandler):
 
 Namespace = T.Trait(NamespaceTraitHandler())
 
+def ip_to_int(address):
+    """str -> int
+
+    Raises ValueError if `address` is not a dotted quad IPv4 address.
+    """
+
+    parts = address.split('.')
+    if len(parts) != 4:
+        raise ValueError, 'Not an IPv4 address: {!r}'.format(address)
+
+    value = 0
+    for part in parts:
+        if not part.isdigit() or len(part) > 3:
+            raise ValueError, 'Not an IPv4 address: {!r}'.format(address)
+        octet = int(part)
+        if octet > 255:
+            raise ValueError, 'Not an IPv4 address: {!r}'.format(address)
+        value = value << 8 | octet
+
+    return value
+
+
+def int_to_ip(value):
+    """int -> str"""
+    return '{}.{}.{}.{}'.format(value >> 24 & 255, value >> 16 & 255,
+                                value >> 8 & 255, value & 255)
+
+
 class IPv4TraitHandler(TraitHandler):
 
     def _components(self, value):
-        parts = value.split('.')
-        if len(parts) != 4:
-            return False, parts
-
-        asints = map(int, parts)
-        for part in asints:
-            if not 0 <= part <= 255:
-                return False, part
+        try:
+            ip_to_int(value)
+        except (ValueError, AttributeError):
+            return False, value
 
         return True, value
 
@@ -48,6 +74,177 @@ class IPv4TraitHandler(TraitHandler):
 TIPv4 = T.Trait(IPv4TraitHandler())
 
 
+class IPv4Pool(object):
+    """Addresses of an IPv4 subnet, stored as integers
+
+    Keeps an index of the addresses in use, so that collisions are
+    detected as addresses are claimed, and hands out the lowest unused
+    host addresses of the subnet.  The network and broadcast addresses
+    and the first `reserved` host addresses (eg the gateway) are never
+    handed out.
+
+    >>> pool = IPv4Pool('10.0.2.0/24')
+    >>> pool.allocate('slave0')
+    '10.0.2.2'
+    >>> pool.claim('10.0.2.3', 'slave1')
+    >>> pool.claim('10.0.2.3', 'slave2')
+    Traceback (most recent call last):
+    ...
+    ValueError: 10.0.2.3 of slave2 is already used by slave1
+    """
+
+    def __init__(self, cidr=None, reserved=1):
+        self.owners = dict()
+
+        if cidr is None:
+            self.first = self.last = None
+        else:
+            network, _, length = cidr.partition('/')
+            length = int(length or 32)
+            assert 0 <= length <= 32, cidr
+            mask = (0xffffffff << (32 - length)) & 0xffffffff
+            network = ip_to_int(network) & mask
+            broadcast = network | (~mask & 0xffffffff)
+            self.first = network + 1 + reserved
+            self.last = broadcast - 1
+
+        self._next = self.first
+
+    def __contains__(self, address):
+        return ip_to_int(address) in self.owners
+
+    def claim(self, address, owner):
+        """Mark `address` as used by `owner`, raising ValueError if it is taken"""
+
+        value = ip_to_int(address)
+        if value in self.owners:
+            raise ValueError, '{} of {} is already used by {}'\
+                .format(address, owner, self.owners[value])
+        self.owners[value] = owner
+
+    def allocate(self, owner):
+        """Hand the lowest unused address of the subnet to `owner`"""
+
+        if self.first is None:
+            raise ValueError, 'No subnet to allocate an address for {} from'.format(owner)
+
+        value = self._next
+        while value in self.owners:
+            value += 1
+        if value > self.last:
+            raise ValueError, 'Subnet exhausted allocating an address for {}'.format(owner)
+
+        self.owners[value] = owner
+        self._next = value + 1
+        return int_to_ip(value)
+
+
+def assign_addresses(nodes, subnet=None):
+    """[Node] -> str or None -> IPv4Pool
+
+    Check that no two nodes share an `ip`, and give the nodes without
+    one the next free address of `subnet` (a CIDR such as
+    '10.0.0.0/16'), if given.  All explicit addresses are claimed
+    before any are handed out.  Raises ValueError listing every
+    collision.
+    """
+
+    pool = IPv4Pool(subnet)
+    errors = []
+    missing = []
+
+    for node in nodes:
+        if node.ip is None:
+            missing.append(node)
+            continue
+        try:
+            pool.claim(node.ip, node.hostname)
+        except ValueError, e:
+            errors.append(str(e))
+
+    if errors:
+        raise ValueError, 'Duplicate addresses: {}'.format(', '.join(errors))
+
+    if subnet is not None:
+        for node in missing:
+            node.ip = pool.allocate(node.hostname)
+
+    return pool
+
+
+_SIMPLE_TYPES = frozenset([int, float, bool, str, None.__class__])
+
+def simpletype(val):
+    """Convert `val` to the builtin types that can be serialized"""
+
+    if type(val) in _SIMPLE_TYPES:
+        return val
+    elif isinstance(val, list):
+        return map(simpletype, val)
+    elif isinstance(val, dict):
+        r = {}
+        for k, v in val.iteritems():
+            r[k] = simpletype(v)
+        return r
+    elif isinstance(val, unicode):
+        return str(val)
+    elif isinstance(val, int) \
+         or isinstance(val, float) \
+         or isinstance(val, bool) \
+         or isinstance(val, str) \
+         or isinstance(val, None.__class__):
+        return val
+    else:
+        raise ValueError, 'Unable to simplify {} {}'.format(val, type(val))
+
+
+def memoize_node_class(maxsize=32):
+    """int -> (function -> function)
+
+    Memoize a function of `(spec, provider=None)` that generates a
+    class on the provider and a hash of `spec.defaults`, which is all
+    the generated classes depend on.  At most `maxsize` classes are
+    kept, the least recently used are evicted first.
+    """
+
+    import collections
+    import functools
+    import hashlib
+    import json
+    import threading
+
+    def decorator(fn):
+
+        cache = collections.OrderedDict()
+        lock = threading.Lock()
+
+        @functools.wraps(fn)
+        def wrapper(spec, provider=None):
+            defaults = json.dumps(spec.defaults, sort_keys=True, default=repr)
+            key = (provider or spec.defaults.provider,
+                   hashlib.sha1(defaults).hexdigest())
+
+            with lock:
+                if key in cache:
+                    clazz = cache[key] = cache.pop(key)
+                    return clazz
+
+            clazz = fn(spec, provider=provider)
+
+            with lock:
+                cache[key] = clazz
+                while len(cache) > maxsize:
+                    cache.popitem(last=False)
+
+            return clazz
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
+
+
+@memoize_node_class()
 def mk_node_class(spec, provider=None):
     """str -> Namespace -> type
 
@@ -69,24 +266,6 @@ def mk_node_class(spec, provider=None):
 
         def to_simple_types(self):
 
-            def simpletype(val):
-                if isinstance(val, list):
-                    return map(simpletype, val)
-                elif isinstance(val, dict):
-                    r = {}
-                    for k, v in val.iteritems():
-                        r[k] = simpletype(v)
-                elif isinstance(val, unicode):
-                    return str(val)
-                elif isinstance(val, int) \
-                     or isinstance(val, float) \
-                     or isinstance(val, bool) \
-                     or isinstance(val, str) \
-                     or isinstance(val, None.__class__):
-                    return val
-                else:
-                    raise ValueError, 'Unable to simplify {} {}'.format(val, type(val))
-
             fields = {}
             for k, v in self.get().iteritems():
                 fields[k] = simpletype(v)
@@ -130,17 +309,292 @@ def mk_node_class(spec, provider=None):
     return clazz
 
 
-def mk_nodes(spec, provider=None):
-    """str -> Namespace or None -> [Node]
+def _is_str(value):
+    return isinstance(value, basestring)
+
+def _is_int(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+def _is_bool(value):
+    return isinstance(value, bool)
+
+def _is_dict(value):
+    return isinstance(value, dict)
+
+def _is_str_list(value):
+    return isinstance(value, list) and all(isinstance(v, basestring) for v in value)
+
+def _is_ipv4(value):
+    try:
+        ip_to_int(value)
+        return True
+    except (ValueError, AttributeError):
+        return False
+
+def _is_optional_ipv4(value):
+    return value is None or _is_ipv4(value)
+
+
+def node_fields(spec, provider=None):
+    """Namespace -> str or None -> ([(str, object, function)], dict)
+
+    The fields of the nodes for `provider` as (name, default, check)
+    triples, along with the provider specific class attributes.  These
+    mirror the traits defined by `mk_node_class`.
+    """
+
+    defaults = spec.defaults
+
+    fields = [
+        ('hostname', '', _is_str),
+        ('ip', None, _is_optional_ipv4),
+        ('netmask', defaults.netmask, _is_ipv4),
+        ('public_key', defaults.public_key, _is_str),
+        ('private_key', defaults.private_key, _is_str),
+        ('domain_name', defaults.domain_name, _is_str),
+        ('extra_disks', dict(vars(defaults.extra_disks)), _is_dict),
+    ]
+    attributes = dict()
+
+    provider = provider or defaults.provider
+
+    if provider == 'libvirt':
+        fields += [
+            ('cpus', defaults.libvirt.cpus, _is_int),
+            ('memory', defaults.libvirt.memory, _is_int),
+        ]
+
+    elif provider == 'openstack':
+        parms = defaults.openstack
+        fields += [
+            ('flavor', parms.flavor, _is_str),
+            ('image', parms.image, _is_str),
+            ('key_name', parms.key_name, _is_str),
+            ('network', parms.network, _is_str),
+            ('create_floating_ip', parms.create_floating_ip, _is_bool),
+            ('floating_ip_pool', parms.floating_ip_pool, _is_str),
+            ('security_groups', list(parms.security_groups), _is_str_list),
+            ('floating_ip', None, _is_optional_ipv4),
+        ]
+
+    elif provider == 'vagrant':
+        attributes = dict(
+            provider = defaults.vagrant.provider,
+            box = defaults.vagrant.box,
+        )
+
+    else:
+        raise NotImplementedError, provider
+
+    return fields, attributes
+
+
+class NodeRecord(object):
+    """Compact alternative to the traits based Node classes
+
+    The fields are stored in `__slots__`.  Like traits, fields that
+    were never assigned take up no space and read as their default,
+    mutable defaults are copied on first access.  Assignments are not
+    validated, instead `validate_fields` checks the values given to
+    many records at once.  Attributes that are not fields are kept
+    aside and, like with the traits classes, included in `get` and
+    `to_simple_types`.
+
+    Subclasses are constructed with `mk_record_class`.
+    """
+
+    __slots__ = ('_extra',)
+
+    _fields = ()
+    _defaults = dict()
+    _checks = dict()
+
+    def __init__(self, **kws):
+        self._extra = None
+        for name, value in kws.iteritems():
+            self.set(name, value)
+
+    def __getattr__(self, name):
+        # only called if `name` is an unassigned field or not a field
+        defaults = self._defaults
+        if name in defaults:
+            value = defaults[name]
+            if isinstance(value, (list, dict)):
+                value = type(value)(value)
+                setattr(self, name, value)
+            return value
+
+        extra = object.__getattribute__(self, '_extra')
+        if extra is not None and name in extra:
+            return extra[name]
+        raise AttributeError, name
+
+    def set(self, name, value):
+        """Set field `name`, or an extra attribute if there is no such field"""
+        if name in self._defaults:
+            setattr(self, name, value)
+        else:
+            if self._extra is None:
+                self._extra = dict()
+            self._extra[name] = value
+
+    def get(self):
+        values = dict((name, getattr(self, name)) for name in self._fields)
+        if self._extra:
+            values.update(self._extra)
+        return values
+
+    def to_simple_types(self):
+
+        fields = {}
+        for k, v in self.get().iteritems():
+            fields[k] = simpletype(v)
+
+        return fields
+
+    def __repr__(self):
+        return '<{} {}>'.format(type(self).__name__, self.hostname)
+
+
+@memoize_node_class()
+def mk_record_class(spec, provider=None):
+    """Namespace -> str or None -> type
+
+    Construct the `NodeRecord` subclass for `provider` with default
+    values provided in the specification.
+    """
+
+    provider = provider or spec.defaults.provider
+    fields, attributes = node_fields(spec, provider=provider)
+
+    names = tuple(name for name, _, _ in fields)
+
+    namespace = dict(attributes)
+    namespace.update(
+        __slots__ = names,
+        _fields = names,
+        _defaults = dict((name, default) for name, default, _ in fields),
+        _checks = dict((name, check) for name, _, check in fields),
+    )
+
+    clazz = type('{}NodeRecord'.format(provider.capitalize()), (NodeRecord,), namespace)
+    validate_fields(clazz, [(name, default, '<defaults>')
+                            for name, default, _ in fields])
+    return clazz
+
+
+def validate_fields(clazz, assignments):
+    """type -> [(str, object, str)] -> ()
+
+    Check the values assigned to the fields of records of type
+    `clazz`, given as (field, value, hostname) triples, in one pass.
+    Each distinct value is only checked once.  Raises ValueError
+    listing all the invalid values.
+    """
+
+    errors = []
+    valid = set()
+
+    for name, value, hostname in assignments:
+        try:
+            key = (name, type(value), value)
+            if key in valid:
+                continue
+        except TypeError:
+            # unhashable, eg lists
+            key = None
+
+        if clazz._checks[name](value):
+            if key is not None:
+                valid.add(key)
+        else:
+            errors.append('{}.{} = {!r}'.format(hostname, name, value))
+
+    if errors:
+        raise ValueError, 'Invalid node values: {}'.format(', '.join(errors))
+
+
+def records_to_nodes(spec, records, provider=None):
+    """Namespace -> [NodeRecord] -> str or None -> [Node]
+
+    Convert records to the traits based Node classes
+    """
+
+    clazz = mk_node_class(spec, provider=provider)
+
+    def traits(record):
+        # unset addresses are None, which the address traits reject
+        return dict((k, v) for k, v in record.get().iteritems() if v is not None)
+
+    return [clazz(**traits(record)) for record in records]
+
+
+def mk_records(spec, provider=None):
+    """Namespace -> str or None -> [NodeRecord]
+
+    Like `mk_nodes`, but construct `NodeRecord`s.  The values are
+    validated together once all records are constructed.
+    """
+
+    provider = provider or spec.defaults.provider
+    clazz = mk_record_class(spec, provider=provider)
+    fields = clazz._defaults
+
+    records = []
+    assignments = []
+
+    for mach in iter_machines(spec.machines):
+        assert len(mach) == 1, mach
+        assert isinstance(mach, dict)
+
+        record = clazz()
+        hostname, params = mach.items()[0]
+        assert isinstance(hostname, str)
+        assert isinstance(params, dict)
+
+        record.hostname = hostname
+        for name, value in params.iteritems():
+
+            if name == provider:
+                assert isinstance(value, dict)
+                items = value.iteritems()
+            else:
+                items = [(name, value)]
+
+            for k, v in items:
+                record.set(k, v)
+                if k in fields:
+                    assignments.append((k, v, hostname))
+
+        records.append(record)
+
+    validate_fields(clazz, assignments)
+    assign_addresses(records, subnet=spec.defaults.get('subnet'))
+    return records
+
+
+def mk_nodes(spec, provider=None, compact=False):
+    """str -> Namespace or None -> bool -> [Node]
     
     Construct the appropriate Node instances for a provider given a
     specification.
+
+    Nodes without an `ip` are assigned one from the `subnet` given in
+    the specification's defaults, if any (see `assign_addresses`).
+
+    If `compact` the nodes are `NodeRecord`s (see `mk_records`) rather
+    than traits objects.
     """
 
+    provider = provider or spec.defaults.provider
+
+    if compact:
+        return mk_records(spec, provider=provider)
+
     clazz = mk_node_class(spec, provider=provider)
 
     def mk():
-        for mach in spec.machines:
+        for mach in iter_machines(spec.machines):
             assert len(mach) == 1, mach
             assert isinstance(mach, dict)
 
@@ -163,19 +617,28 @@ def mk_nodes(spec, provider=None):
                         
             yield node
 
-    return list(mk())
+    nodes = list(mk())
+    assign_addresses(nodes, subnet=spec.defaults.get('subnet'))
+    return nodes
 
 
 def update_spec(spec, nodes):
     """Namespace -> [Node] -> ()
 
     Updates *in-place* `spec` with `nodes`
+
+    The inventory groups are indexed in an `Inventory`, stored as
+    `spec.inventory_index`, and each group is replaced by a view that
+    yields its nodes.
     """
 
-    lookup = dict([(n.hostname, n) for n in nodes])
-    assert len(lookup) == len(nodes)
+    index = Inventory()
+    for node in nodes:
+        index.intern(node.hostname)
+    assert len(index) == len(nodes)
+    index.nodes = list(nodes)
 
-    assert len(spec.machines) == len(nodes)
+    assert count_machines(spec.machines) == len(nodes)
     spec.machines = nodes
 
     for group in spec.inventory:
@@ -183,34 +646,316 @@ def update_spec(spec, nodes):
         groupname = group.keys()[0]
         hostnames = group.values()[0]
 
-        for i in xrange(len(hostnames)):
-            hostname = hostnames[i]
-            group[groupname][i] = lookup[hostname]
+        index.add_group(groupname, hostnames, strict=True)
+        group[groupname] = index.view(groupname)
 
+    spec.inventory_index = index
 
 
-def mk_namespace(spec_dict):
-    """dict -> Namespace
+class Inventory(object):
+    """Index of the inventory groups over interned hostnames
+
+    Every hostname is interned to an integer id, in order of first
+    appearance.  Groups are stored as arrays of ids (or left as
+    `HostGroup`s, whose ids are only computed when needed) and as
+    bitsets for set operations, so unions and intersections of groups
+    are operations on integers.  The reverse map from hosts to their
+    groups is built on demand.
+
+    Once `nodes` is set to the nodes ordered by id (see `update_spec`)
+    the groups can be viewed as lists of nodes.
+    """
 
-    Provides a nice dotted attribute access to the elements of a
-    dictionary.
+    def __init__(self):
+        import collections
+
+        self.hostnames = []
+        self.ids = dict()
+        self.nodes = None
+        self._groups = collections.OrderedDict()
+        self._bits = dict()
+        self._hostgroup_ids = dict()
+        self._host_groups = None
+
+    def __len__(self):
+        return len(self.hostnames)
+
+    def __contains__(self, groupname):
+        return groupname in self._groups
+
+    def __iter__(self):
+        return iter(self._groups)
+
+    def intern(self, hostname):
+        """str -> int"""
+        try:
+            return self.ids[hostname]
+        except KeyError:
+            ident = self.ids[hostname] = len(self.hostnames)
+            self.hostnames.append(hostname)
+            return ident
+
+    def add_group(self, name, hostnames, strict=False):
+        """Add group `name` with members `hostnames`
+
+        If `strict` all members must have been interned already,
+        otherwise KeyError is raised.
+        """
+
+        from array import array
+
+        self._bits.pop(name, None)
+        self._hostgroup_ids.pop(name, None)
+        self._host_groups = None
+
+        intern = self.ids.__getitem__ if strict else self.intern
+
+        if isinstance(hostnames, HostGroup):
+            for hostname in hostnames.hostnames():
+                intern(hostname)
+            self._groups[name] = hostnames
+            return
+
+        self._groups[name] = array('l', map(intern, hostnames))
+
+    def group_ids(self, name):
+        """str -> [int]"""
+        from array import array
 
-    eg:
-    >>> s = mk_namespace({'foo':{'bar': 42}, baz = 24})
-    >>> s.foo.bar
-    42
-    >>> s.baz
-    24
+        members = self._groups[name]
+        if isinstance(members, HostGroup):
+            if name not in self._hostgroup_ids:
+                self._hostgroup_ids[name] = array(
+                    'l', map(self.ids.__getitem__, members.hostnames()))
+            return self._hostgroup_ids[name]
+        return members
+
+    def bits(self, name):
+        """str -> long
+
+        The members of group `name` as a bitset of their ids
+        """
+
+        if name not in self._bits:
+            bits = 0
+            for ident in self.group_ids(name):
+                bits |= 1 << ident
+            self._bits[name] = bits
+        return self._bits[name]
+
+    def _from_bits(self, name, bits):
+        from array import array
+
+        # least significant bit first
+        digits = bin(bits)[:1:-1]
+        ids = array('l', (ident for ident, digit in enumerate(digits)
+                          if digit == '1'))
+
+        self._groups[name] = ids
+        self._bits[name] = bits
+        self._hostgroup_ids.pop(name, None)
+        self._host_groups = None
+        return ids
+
+    def union(self, name, *groups):
+        """Add group `name` with the members of any of `groups`, ordered by id"""
+        bits = reduce(lambda a, b: a | b, map(self.bits, groups), 0)
+        return self._from_bits(name, bits)
+
+    def intersection(self, name, *groups):
+        """Add group `name` with the members of all of `groups`, ordered by id"""
+        bits = reduce(lambda a, b: a & b, map(self.bits, groups))
+        return self._from_bits(name, bits)
+
+    def members(self, name):
+        """str -> generator of str"""
+        hostnames = self.hostnames
+        return (hostnames[ident] for ident in self.group_ids(name))
+
+    def groups_of(self, hostname):
+        """str -> [str]
+
+        The names of the groups `hostname` is a member of, in the order
+        the groups were added
+        """
+
+        if self._host_groups is None:
+            host_groups = [[] for _ in self.hostnames]
+            for name in self._groups:
+                for ident in self.group_ids(name):
+                    host_groups[ident].append(name)
+            self._host_groups = host_groups
+
+        ident = self.ids.get(hostname)
+        return [] if ident is None else list(self._host_groups[ident])
+
+    def view(self, name):
+        return InventoryView(self, name)
+
+
+class InventoryView(object):
+    """The nodes of an `Inventory` group, looked up while iterating"""
+
+    def __init__(self, index, name):
+        self.index = index
+        self.name = name
+
+    def __iter__(self):
+        nodes = self.index.nodes
+        members = self.index._groups[self.name]
+        if isinstance(members, HostGroup):
+            # avoid materializing the ids of a range based group
+            ids = self.index.ids
+            return (nodes[ids[hostname]] for hostname in members.hostnames())
+        return (nodes[ident] for ident in members)
+
+    def __len__(self):
+        return len(self.index._groups[self.name])
+
+    def __getitem__(self, i):
+        return self.index.nodes[self.index.group_ids(self.name)[i]]
+
+    def __repr__(self):
+        return 'InventoryView({!r})'.format(self.name)
+
+
+class HostRange(object):
+    """A range of similar machines, expanded lazily
+
+    `pattern` is a hostname with a single inclusive range of indices in
+    brackets, eg 'slave[0-999]' or 'node[001-100]' (zero padded).  The
+    fields are the machine's parameters.  Callable values are called
+    with the index, strings are formatted with it (as `{}` or `{i}`)
+    and dictionaries and lists are templated recursively:
+
+    >>> slaves = hostrange('slave[0-999]', ip=lambda i: '10.0.{}.{}'.format(2 + i // 250, i % 250),
+    ...                    openstack={'flavor': 'm1.large'})
+    >>> slaves(3)
+    {'slave3': {'ip': '10.0.2.3', 'openstack': {'flavor': 'm1.large'}}}
+
+    A HostRange can be used wherever a machine function (such as the
+    ones given to `expand` and `group`) is expected and can be put
+    directly in the `machines` of a specification, in which case its
+    machines are only constructed while iterating over them.
     """
 
-    def mk(obj):
-        for k in obj.iterkeys():
-            v = obj[k]
-            if isinstance(v, dict):
-                obj[k] = mk(obj[k])
-        return EasyDict(**obj)
+    def __init__(self, pattern, **fields):
+        import re
 
-    return mk(spec_dict)
+        match = re.match(r'^(.*)\[(\d+)-(\d+)\](.*)$', pattern)
+        if not match:
+            raise ValueError, 'Not a host range: {!r}'.format(pattern)
+
+        self.pattern = pattern
+        self.prefix, start, stop, self.suffix = match.groups()
+        self.width = len(start) if start.startswith('0') and len(start) > 1 else 0
+        self.start, self.stop = int(start), int(stop)
+        self.fields = fields
+
+        if self.stop < self.start:
+            raise ValueError, 'Empty host range: {!r}'.format(pattern)
+
+    @property
+    def indices(self):
+        return xrange(self.start, self.stop + 1)
+
+    def __len__(self):
+        return self.stop - self.start + 1
+
+    def __contains__(self, index):
+        return self.start <= index <= self.stop
+
+    def hostname(self, index):
+        return '{}{:0{}d}{}'.format(self.prefix, index, self.width, self.suffix)
+
+    def params(self, index):
+
+        def render(value):
+            if callable(value):
+                return value(index)
+            elif isinstance(value, basestring) and '{' in value:
+                return value.format(index, i=index)
+            elif isinstance(value, dict):
+                return dict((k, render(v)) for k, v in value.iteritems())
+            elif isinstance(value, list):
+                return map(render, value)
+            else:
+                return value
+
+        return render(self.fields)
+
+    def __call__(self, index):
+        assert index in self, (self.pattern, index)
+        return {self.hostname(index): self.params(index)}
+
+    def __iter__(self):
+        for index in self.indices:
+            yield self(index)
+
+    def __repr__(self):
+        return 'hostrange({!r})'.format(self.pattern)
+
+
+def hostrange(pattern, **fields):
+    """str -> ... -> HostRange"""
+    return HostRange(pattern, **fields)
+
+
+def iter_machines(machines):
+    """[dict or HostRange] -> generator of dict
+
+    Iterate over the machine definitions of a specification, expanding
+    host ranges lazily.
+    """
+
+    for mach in machines:
+        if isinstance(mach, HostRange):
+            for m in mach:
+                yield m
+        else:
+            yield mach
+
+
+def count_machines(machines):
+    """[dict or HostRange or Node] -> int"""
+    return sum(len(m) if isinstance(m, HostRange) else 1 for m in machines)
+
+
+class HostGroup(object):
+    """The members of an inventory group, stored as index ranges
+
+    `members` is a list of (HostRange, indices) pairs.  Iterating over
+    the group yields the hostnames.
+    """
+
+    def __init__(self, members):
+        self.members = members
+
+    def hostnames(self):
+        for hosts, indices in self.members:
+            for index in indices:
+                yield hosts.hostname(index)
+
+    def __iter__(self):
+        return self.hostnames()
+
+    def __len__(self):
+        return sum(len(indices) for _, indices in self.members)
+
+    def __repr__(self):
+        return 'HostGroup({!r})'.format(self.members)
+
+
+def _compact_indices(indices):
+    """[int] -> xrange or tuple
+
+    Sorted, unique `indices`, as an xrange if they are contiguous
+    """
+
+    indices = sorted(set(indices))
+    if indices and indices[-1] - indices[0] + 1 == len(indices):
+        return xrange(indices[0], indices[-1] + 1)
+    return tuple(indices)
 
 
 
@@ -223,6 +968,16 @@ def expand(fn, count):
 
 
 def group(name, groupdef):
+    """str -> [(function or HostRange, [int])] -> {str: [str]}
+
+    If every member is a HostRange the group is stored as a
+    `HostGroup` of index ranges instead of a list of hostnames.
+    """
+
+    if all(isinstance(fn, HostRange) for fn, _ in groupdef):
+        members = [(fn, indices if isinstance(indices, xrange) else tuple(indices))
+                   for fn, indices in groupdef]
+        return {name: HostGroup(members)}
 
     def names():
         for fn, indices in groupdef:
@@ -232,18 +987,88 @@ def group(name, groupdef):
     return {name: list(chain(*names()))}
 
 
+def _group_members(groups):
+    """[{str: [str] or HostGroup}] -> [[str] or HostGroup]"""
+    return [names for group in groups for names in group.itervalues()]
+
+
+def _index_groups(members):
+    """[[str] or HostGroup] -> (Inventory, [str])
+
+    Index `members` as the anonymous groups of a new `Inventory`
+    """
+
+    index = Inventory()
+    names = []
+    for i, hostnames in enumerate(members):
+        names.append(str(i))
+        index.add_group(names[-1], hostnames)
+    return index, names
+
+
 def combine(name, *groups):
+    """str -> {str: [str] or HostGroup}... -> {str: [str] or HostGroup}
+
+    The union of `groups`.  If every member is a `HostGroup` the
+    result is a `HostGroup` too, otherwise it is a list of hostnames
+    sorted by name.
+    """
 
-    def work():
-        for group in groups:
-            # print 'group =', group.keys()
-            for names in group.itervalues():
-                # print 'names =', names
-                for n in names:
-                    # print 'n =', n
-                    yield n
+    members = _group_members(groups)
 
-    return {name: list(sorted(set(work())))}
+    if members and all(isinstance(names, HostGroup) for names in members):
+        # union the index sets of each host range
+        ranges = []
+        indices = dict()
+        for names in members:
+            for hosts, idx in names.members:
+                if id(hosts) not in indices:
+                    ranges.append(hosts)
+                    indices[id(hosts)] = set()
+                indices[id(hosts)].update(idx)
+
+        return {name: HostGroup([(hosts, _compact_indices(indices[id(hosts)]))
+                                 for hosts in ranges])}
+
+    index, names = _index_groups(members)
+    index.union(name, *names)
+    return {name: sorted(index.members(name))}
+
+
+def intersect(name, *groups):
+    """str -> {str: [str] or HostGroup}... -> {str: [str] or HostGroup}
+
+    The hosts that are in all of `groups`, like `combine`
+    """
+
+    members = _group_members(groups)
+    assert members, name
+
+    if all(isinstance(names, HostGroup) for names in members):
+        # intersect the index sets of each host range
+        def indices(names):
+            result = dict()
+            for hosts, idx in names.members:
+                result.setdefault(id(hosts), set()).update(idx)
+            return result
+
+        common = indices(members[0])
+        for names in members[1:]:
+            other = indices(names)
+            for key in common.keys():
+                common[key] &= other.get(key, set())
+
+        ranges = []
+        for hosts, _ in members[0].members:
+            if common.get(id(hosts)) and hosts not in ranges:
+                ranges.append(hosts)
+
+        return {name: HostGroup([(hosts, _compact_indices(common[id(hosts)]))
+                                 for hosts in ranges])}
+
+    index, names = _index_groups(members)
+    index.intersection(name, *names)
+    return {name: sorted(index.members(name))}
 
 
 def inventory_format(spec):
@@ -279,18 +1104,319 @@ def inventory_format(spec):
     # return yaml.dump(inv, default_flow_style=False)
 
 
-def load_spec(path):
-    
-    modname = 'module_' + uuid.uuid1().hex
-    moddesc = ('.py', 'r', imp.PY_SOURCE) # FIXME: .py
-    mod = imp.load_module(modname, open(path), path, moddesc)
-    return mk_namespace(mod.spec)
+def _node_hostvars(node, fullpath):
+    return dict(ansible_ssh_host=node.floating_ip or node.ip,
+                ansible_ssh_private_key=fullpath(node.private_key))
 
 
-def load_machines(path):
-    d = yaml.load(open(path).read())
-    return mk_namespace(d)
-    
+def inventory_index(spec):
+    """Namespace -> dict
+
+    The inventory of `spec` in the JSON structure of an Ansible dynamic
+    inventory, including `_meta.hostvars` so that Ansible does not
+    query each host separately.
+
+    Variables with the same value for every host are set on the `all`
+    group, those with the same value for every member of a group on
+    that group, and only the remaining ones on the hosts themselves.
+    Host variables take precedence over group variables in Ansible, so
+    this does not change the value any host sees.
+
+    `_meta.hostgroups` lists the groups with variables each host is in,
+    taken from the reverse map of `spec.inventory_index` (see
+    `update_spec`), so that the variables of a single host can be
+    looked up without going through every group.
+    """
+
+    import collections
+    from pxul.os import fullpath
+
+    paths = dict()
+    def fullpath_memo(path):
+        # nodes usually share a single key
+        if path not in paths:
+            paths[path] = fullpath(path)
+        return paths[path]
+
+    hostvars = collections.OrderedDict()
+    groups = collections.OrderedDict()
+
+    for group in spec.inventory:
+        assert len(group) == 1
+        name = group.keys()[0]
+        nodes = group.values()[0]
+
+        hosts = []
+        for node in nodes:
+            if node.hostname not in hostvars:
+                hostvars[node.hostname] = _node_hostvars(node, fullpath_memo)
+            hosts.append(node.hostname)
+        groups[name] = dict(hosts=hosts)
+
+    def uniform_vars(hostnames):
+        hostnames = iter(hostnames)
+        first = next(hostnames, None)
+        if first is None:
+            return dict()
+        shared = dict(hostvars[first])
+        for hostname in hostnames:
+            for key, value in hostvars[hostname].iteritems():
+                if key in shared and shared[key] != value:
+                    del shared[key]
+        return shared
+
+    all_vars = uniform_vars(hostvars)
+
+    for name, group in groups.iteritems():
+        if len(group['hosts']) < 2:
+            continue
+        group_vars = uniform_vars(group['hosts'])
+        for key in all_vars:
+            group_vars.pop(key, None)
+        if group_vars:
+            group['vars'] = group_vars
+
+    inventory = spec.get('inventory_index')
+    if inventory is None:
+        inventory = Inventory()
+        for name, group in groups.iteritems():
+            inventory.add_group(name, group['hosts'])
+
+    hostgroups = dict()
+    for hostname, variables in hostvars.iteritems():
+        names = [name for name in inventory.groups_of(hostname)
+                 if 'vars' in groups[name]]
+        if names:
+            hostgroups[hostname] = names
+        for key in all_vars.keys() + [key for name in names for key in groups[name]['vars']]:
+            variables.pop(key, None)
+
+    index = collections.OrderedDict()
+    index.update(groups)
+    if all_vars:
+        group = index.setdefault('all', dict())
+        group.setdefault('vars', dict()).update(all_vars)
+    index['_meta'] = dict(hostvars=hostvars, hostgroups=hostgroups)
+
+    return index
+
+
+class _EnvironRecorder(object):
+    """Stands in for `os.environ` and records which variables are read
+
+    Anything that depends on the whole environment (eg iterating over
+    it) marks the result as not cacheable.
+    """
+
+    def __init__(self, environ):
+        self._environ = environ
+        self.read = dict()
+        self.cacheable = True
+
+    def _record(self, key):
+        self.read[key] = self._environ.get(key)
+
+    def get(self, key, default=None):
+        self._record(key)
+        return self._environ.get(key, default)
+
+    def __getitem__(self, key):
+        self._record(key)
+        return self._environ[key]
+
+    def __contains__(self, key):
+        self._record(key)
+        return key in self._environ
+
+    has_key = __contains__
+
+    def __iter__(self):
+        self.cacheable = False
+        return iter(self._environ)
+
+    def __len__(self):
+        self.cacheable = False
+        return len(self._environ)
+
+    def __getattr__(self, name):
+        # keys(), items(), copy(), __setitem__, ...
+        self.cacheable = False
+        return getattr(self._environ, name)
+
+    def __setitem__(self, key, value):
+        self.cacheable = False
+        self._environ[key] = value
+
+
+def _exec_spec(path):
+    """str -> (dict, dict or None)
+
+    Execute the specification file at `path` and return its `spec`
+    along with the inputs it read from its surroundings: the
+    environment variables (and their values) and the hostname.  The
+    inputs are None if they could not be determined.
+    """
+
+    import os
+    import socket
+
+    environ = _EnvironRecorder(os.environ)
+    gethostname = socket.gethostname
+    hostname = []
+
+    def recording_gethostname():
+        name = gethostname()
+        hostname.append(name)
+        return name
+
+    os.environ, socket.gethostname = environ, recording_gethostname
+    try:
+        modname = 'module_' + uuid.uuid1().hex
+        moddesc = ('.py', 'r', imp.PY_SOURCE) # FIXME: .py
+        mod = imp.load_module(modname, open(path), path, moddesc)
+    finally:
+        os.environ, socket.gethostname = environ._environ, gethostname
+
+    if not environ.cacheable:
+        return mod.spec, None
+
+    inputs = dict(env=environ.read)
+    if hostname:
+        inputs['hostname'] = hostname[0]
+
+    return mod.spec, inputs
+
+
+def _inputs_match(inputs):
+    import os
+    import socket
+
+    for key, value in inputs['env'].iteritems():
+        if os.environ.get(key) != value:
+            return False
+
+    if 'hostname' in inputs and socket.gethostname() != inputs['hostname']:
+        return False
+
+    return True
+
+
+# the version of the evaluated specification cache, to be increased
+# whenever what a specification evaluates to changes (eg the results of
+# `group` or `combine`) so that older entries are not used
+SPEC_CACHE_FORMAT = 1
+
+
+def _spec_cache_key(contents):
+    """str -> str
+
+    The cache key of a specification file with `contents`, which also
+    depends on the cache format and the version of vcl
+    """
+
+    import hashlib
+
+    try:
+        from vcl.version import full_version
+    except ImportError:
+        # not installed with setup.py
+        full_version = None
+
+    key = hashlib.sha1('{}\0{}\0'.format(SPEC_CACHE_FORMAT, full_version))
+    key.update(contents)
+    return key.hexdigest()
+
+
+def _cache_file_secure(fd):
+    """file -> bool
+
+    Whether the cache file `fd` is owned by the current user and can
+    not be read or written by anyone else
+    """
+
+    import os
+    import stat
+
+    st = os.fstat(fd.fileno())
+    others = stat.S_IRWXG | stat.S_IRWXO
+    return st.st_uid == os.getuid() and not st.st_mode & others
+
+
+def spec_cache_dir():
+    """The default location of the evaluated specification cache"""
+    import os
+    base = os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'vcl', 'specs')
+
+
+def load_spec(path, cache=True, cache_dir=None):
+    """str -> bool -> str or None -> Namespace
+
+    Evaluate the specification file at `path`.
+
+    The evaluated specification is cached in `cache_dir` (default:
+    `spec_cache_dir()`), keyed by the hash of the file contents, the
+    version of vcl and `SPEC_CACHE_FORMAT`.  The environment variables
+    and hostname the file read are stored along with it and the cached
+    copy is only used if they are unchanged.  Files importing local
+    modules other than `vcl` should not be cached, as changes to those
+    modules are not detected.
+
+    Cache files that can not be loaded, or that other users could read
+    or write, are ignored.
+    """
+
+    import cPickle as pickle
+    import os
+    import sys
+
+    if not cache:
+        spec, _ = _exec_spec(path)
+        return mk_namespace(spec)
+
+    cache_dir = cache_dir or spec_cache_dir()
+    digest = _spec_cache_key(open(path, 'rb').read())
+    cache_path = os.path.join(cache_dir, digest + '.pickle')
+
+    try:
+        with open(cache_path, 'rb') as fd:
+            if _cache_file_secure(fd):
+                entry = pickle.load(fd)
+            else:
+                sys.stderr.write('Ignoring cached specification {} as it is accessible by other users\n'
+                                 .format(cache_path))
+                entry = None
+        if entry is not None and _inputs_match(entry['inputs']):
+            return mk_namespace(entry['spec'])
+    except Exception:
+        # missing, or written by another version of vcl: unpickling
+        # can fail in many ways when the classes have changed
+        pass
+
+    spec, inputs = _exec_spec(path)
+
+    if inputs is not None:
+        try:
+            data = pickle.dumps(dict(inputs=inputs, spec=spec),
+                                pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError):
+            # eg lambdas in the specification
+            data = None
+
+        if data is not None:
+            try:
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir, 0700)
+                tmp = '{}.{}.tmp'.format(cache_path, os.getpid())
+                fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+                with os.fdopen(fd, 'wb') as out:
+                    out.write(data)
+                os.rename(tmp, cache_path)
+            except (IOError, OSError):
+                pass
+
+    return mk_namespace(spec)
+
 
 if __name__ == '__main__':
     import sys
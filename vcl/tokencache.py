@@ -0,0 +1,120 @@
+"""
+On-disk cache of Keystone tokens and service catalogs
+"""
+
+import hashlib
+import json
+import os
+import stat
+import sys
+
+
+def token_cache_dir():
+    """The default location of the token cache"""
+    base = os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'vcl', 'tokens')
+
+
+class TokenCache(object):
+    """Keep the authentication of a keystoneclient auth plugin on disk
+
+    The token and service catalog returned by Keystone are stored in
+    `path`, readable by the owner only.  `load` installs a cached token
+    that is not about to expire in the plugin, so that it does not
+    authenticate again; `save` stores the plugin's token if it got a
+    new one.  Cache files that other users could read or write are
+    ignored.
+
+    >>> cache = TokenCache.for_credentials(auth_url, username, project)
+    >>> cache.load(auth)
+    >>> atexit.register(cache.save, auth)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._token = None
+
+    @classmethod
+    def for_credentials(cls, *credentials, **kws):
+        """The cache for `credentials` (eg auth url, user, project)"""
+        cache_dir = kws.pop('cache_dir', None) or token_cache_dir()
+        assert not kws, kws
+        key = hashlib.sha1(json.dumps(credentials)).hexdigest()
+        return cls(os.path.join(cache_dir, key + '.json'))
+
+    def _secure(self, st):
+        others = stat.S_IRWXG | stat.S_IRWXO
+        return st.st_uid == os.getuid() and not st.st_mode & others
+
+    def load(self, auth):
+        """keystoneclient auth plugin -> bool
+
+        Install the cached token in `auth`, if there is a valid one
+        """
+
+        from keystoneclient.access import AccessInfoV2, AccessInfoV3
+
+        try:
+            fd = open(self.path)
+        except IOError:
+            return False
+
+        with fd:
+            if not self._secure(os.fstat(fd.fileno())):
+                sys.stderr.write('Ignoring token cache {} as it is accessible by other users\n'
+                                 .format(self.path))
+                return False
+            try:
+                entry = json.load(fd)
+                if entry['version'] == 'v3':
+                    auth_ref = AccessInfoV3(entry['token'], **entry['body'])
+                else:
+                    auth_ref = AccessInfoV2(**entry['body'])
+            except (ValueError, KeyError, TypeError):
+                return False
+
+        try:
+            if auth_ref.will_expire_soon(auth.MIN_TOKEN_LIFE_SECONDS):
+                return False
+        except (ValueError, TypeError):
+            # unparseable expiry date
+            return False
+
+        auth.auth_ref = auth_ref
+        self._token = auth_ref.auth_token
+        return True
+
+    def save(self, auth):
+        """keystoneclient auth plugin -> ()
+
+        Store the token of `auth`, if it authenticated since `load`
+        """
+
+        from keystoneclient.access import AccessInfoV3
+
+        auth_ref = auth.auth_ref
+        if auth_ref is None or auth_ref.auth_token == self._token:
+            return
+
+        if isinstance(auth_ref, AccessInfoV3):
+            entry = dict(version='v3', token=auth_ref.auth_token,
+                         body=dict(auth_ref))
+        else:
+            entry = dict(version='v2', body=dict(auth_ref))
+
+        directory = os.path.dirname(self.path)
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0700)
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+            with os.fdopen(fd, 'w') as out:
+                json.dump(entry, out)
+            os.rename(tmp, self.path)
+        except (IOError, OSError, TypeError, ValueError):
+            # caching is best effort
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+
+        self._token = auth_ref.auth_token